@@ -1,6 +1,6 @@
 {
     'name': 'POS Livraison Sumni v2',
-    'version': '15.0.3.0.0',
+    'version': '15.0.3.3.0',
     'summary': "Gestion livraison intégrée POS: file d'attente, livraisons partielles, stock, API",
     'description': """
 Module POS Livraison Sumni v2
@@ -17,6 +17,7 @@ Module POS Livraison Sumni v2
     'depends': ['base', 'web', 'bus', 'pos_caisse'],
     "data": [
         "data/pos_livraison_data.xml",
+        "data/pos_livraison_cron.xml",
         "security/ir.model.access.csv",
         "security/pos_livraison_security.xml",
     "views/pos_caisse_commande_views.xml",
@@ -1,27 +1,25 @@
 import logging
 import json
+from datetime import timedelta
+
 from odoo import http, fields
 from odoo.http import request
 
+from .replica import read_on_replica
+
+
+def query_budget(queries):
+    """Déclare le nombre maximal de requêtes SQL d'une route.
+    Le budget ne doit pas dépendre du volume de données: voir tests/test_query_count.py.
+    """
+    def decorator(func):
+        func._query_budget = queries
+        return func
+    return decorator
+
+
 class PosLivraisonController(http.Controller):
     # ==== Helpers: session & payloads ====
-    def _extract_motif_from_notes(self, notes):
-        """Best-effort extraction of motif from notes string for stock-out entries.
-        Expected pattern example: "... | Sortie de stock: <MOTIF> - <qty> sacs - <montant> FC"
-        """
-        try:
-            if not notes:
-                return None
-            key = 'Sortie de stock:'
-            idx = notes.find(key)
-            if idx == -1:
-                return None
-            rest = notes[idx + len(key):].lstrip()
-            # motif ends before the next ' - '
-            motif = rest.split(' - ')[0].strip()
-            return motif or None
-        except Exception:
-            return None
     def _get_open_session_id_for_user(self, uid=None):
         uid = uid or request.env.user.id
         return request.env['pos.livraison.session']._get_open_for_user(uid)
@@ -47,7 +45,31 @@ class PosLivraisonController(http.Controller):
                 'sacs_livres_total': s.sacs_livres_total,
                 'sorties_sacs_total': s.sorties_sacs_total,
                 'sorties_kg_total': s.sorties_kg_total,
+            },
+            'summary': self._summary_to_payload(s.summary_id),
+        }
+
+    def _summary_to_payload(self, summary):
+        if not summary:
+            return None
+        groups = {'type_paiement': {}, 'sortie_stock': {}, 'type_sortie': {}}
+        for line in summary.line_ids:
+            groups[line.dimension][line.cle] = {
+                'nombre': line.nombre,
+                'montant': line.montant,
+                'sacs': line.sacs,
             }
+        return {
+            'date_calcul': summary.date_calcul and summary.date_calcul.isoformat() or None,
+            'nombre_livraisons': summary.nombre_livraisons,
+            'nombre_commandes': summary.nombre_commandes,
+            'montant_total': summary.montant_total,
+            'sacs_total': summary.sacs_total,
+            'premiere_livraison': summary.date_premiere_livraison and summary.date_premiere_livraison.isoformat() or None,
+            'derniere_livraison': summary.date_derniere_livraison and summary.date_derniere_livraison.isoformat() or None,
+            'par_type_paiement': groups['type_paiement'],
+            'par_sortie_stock': groups['sortie_stock'],
+            'par_type_sortie': groups['type_sortie'],
         }
 
     def _compute_user_role_payload(self):
@@ -118,6 +140,7 @@ class PosLivraisonController(http.Controller):
 
     # ==== Livraison sessions API ====
     @http.route('/api/livraison/session/status', type='json', auth='user', methods=['GET', 'POST'])
+    @query_budget(15)
     def session_status(self):
         sid = self._get_open_session_id_for_user()
         session = sid and request.env['pos.livraison.session'].browse(sid) or False
@@ -141,6 +164,7 @@ class PosLivraisonController(http.Controller):
         return request.make_response(json.dumps(payload), headers=[('Content-Type', 'application/json')])
 
     @http.route('/api/livraison/session/open', type='json', auth='user', methods=['POST'])
+    @query_budget(20)
     def session_open(self):
         sid = self._get_open_session_id_for_user()
         if not sid:
@@ -149,6 +173,7 @@ class PosLivraisonController(http.Controller):
         return {'status': 'success', 'data': self._session_to_payload(session)}
 
     @http.route('/api/livraison/session/close', type='json', auth='user', methods=['POST'])
+    @query_budget(35)
     def session_close(self):
         sid = self._get_open_session_id_for_user()
         if not sid:
@@ -160,6 +185,7 @@ class PosLivraisonController(http.Controller):
         return {'status': 'success', 'data': self._session_to_payload(session)}
 
     @http.route('/api/livraison/commandes', type='json', auth='user', methods=['POST'])
+    @query_budget(20)
     def get_commandes(self, **params):
         logging.info("=========== les paramettres dans /api/livraison/commandes: %s", params)
         # Filtre de base : seulement les commandes avec un état de livraison défini
@@ -168,8 +194,8 @@ class PosLivraisonController(http.Controller):
         if etat:
             domain.append(('etat_livraison', '=', etat))
         else:
-            # Par défaut, exclure les commandes livrées et annulées
-            domain.append(('etat_livraison', 'not in', ['livree', 'annulee']))
+            # Par défaut, exclure les commandes livrées et annulées (liste positive: index partiel des états actifs)
+            domain.append(('etat_livraison', 'in', ['en_queue', 'en_cours', 'livree_partielle']))
         priority = params.get('priority') or params.get('priority_livraison')
         if priority:
             domain.append(('priority_livraison', '=', priority))
@@ -198,6 +224,7 @@ class PosLivraisonController(http.Controller):
         return {'status': 'success', 'data': data, 'total': total_count, 'offset': offset, 'returned': len(data)}
 
     @http.route('/api/livraison/livraisons', type='json', auth='user', methods=['POST'])
+    @query_budget(25)
     def list_livraisons(self, **params):
         """List delivery records constrained by session by default.
         Params:
@@ -250,6 +277,12 @@ class PosLivraisonController(http.Controller):
         offset = int(params.get('offset', 0))
         limit = int(params.get('limit', 80)) if params.get('limit') else None
         order = params.get('order', 'date desc')
+        if session_mode == 'none':
+            # Lecture de reporting (toutes sessions): réplique si configurée
+            return read_on_replica(env, self._livraisons_payload, domain, offset, limit, order)
+        return self._livraisons_payload(env, domain, offset, limit, order)
+
+    def _livraisons_payload(self, env, domain, offset, limit, order):
         Liv = env['pos.livraison.livraison']
         livs = Liv.search(domain, offset=offset, limit=limit, order=order)
         total = Liv.search_count(domain)
@@ -263,7 +296,8 @@ class PosLivraisonController(http.Controller):
             'sacs_farine': l.sacs_farine,
             'prix_sac': l.prix_sac,
             'type_paiement': l.type_paiement,
-            'motif': (self._extract_motif_from_notes(l.notes) if getattr(l, 'is_sortie_stock', False) else None),
+            'motif': l.motif if l.is_sortie_stock else None,
+            'type_sortie': l.type_sortie if l.is_sortie_stock else None,
             'livreur': l.livreur or (l.livreur_id and l.livreur_id.name) or None,
             'livreur_id': l.livreur_id.id if l.livreur_id else None,
             'notes': l.notes,
@@ -274,6 +308,7 @@ class PosLivraisonController(http.Controller):
         return {'status': 'success', 'data': data, 'total': total, 'offset': offset, 'returned': len(data)}
 
     @http.route('/api/livraison/commande/<int:commande_id>', type='json', auth='user', methods=['GET'])
+    @query_budget(25)
     def get_commande_detail(self, commande_id):
         c = request.env['pos.caisse.commande'].browse(commande_id)
         if not c.exists():
@@ -291,7 +326,8 @@ class PosLivraisonController(http.Controller):
             'sacs_farine': l.sacs_farine,
             'prix_sac': l.prix_sac,
             'type_paiement': l.type_paiement,
-            'motif': (self._extract_motif_from_notes(l.notes) if getattr(l, 'is_sortie_stock', False) else None),
+            'motif': l.motif if l.is_sortie_stock else None,
+            'type_sortie': l.type_sortie if l.is_sortie_stock else None,
             'livreur': l.livreur or (l.livreur_id and l.livreur_id.name) or None,
             'livreur_id': l.livreur_id.id if l.livreur_id else None,
             'notes': l.notes,
@@ -324,10 +360,14 @@ class PosLivraisonController(http.Controller):
         }}
 
     @http.route('/api/livraison/nouvelle_livraison', type='json', auth='user', methods=['POST'])
+    @query_budget(60)
     def create_livraison(self, **payload):
         logging.getLogger(__name__).info("================ Creating new livraison with payload: %s", payload)
         
         params = http.request.jsonrequest or payload
+        # Unwrap JSON-RPC envelope if present
+        if isinstance(params, dict) and isinstance(params.get('params'), dict):
+            params = params['params']
         logging.info("=================== Payload received: %s", params)
         try:
             # Enforce an open session for API usage to reflect client UX
@@ -388,6 +428,7 @@ class PosLivraisonController(http.Controller):
             return {'status': 'error', 'message': str(e)}
 
     @http.route('/api/livraison/queue', type='json', auth='user', methods=['GET'])
+    @query_budget(15)
     def get_queue(self):
         commandes = request.env['pos.caisse.commande'].search([
             ('etat_livraison', '!=', False),
@@ -404,15 +445,86 @@ class PosLivraisonController(http.Controller):
         } for i, c in enumerate(commandes)]
         return {'status': 'success', 'data': data}
 
+    @http.route('/api/livraison/dispatch/next', type='json', auth='user', methods=['GET', 'POST'])
+    @query_budget(30)
+    def dispatch_next(self):
+        """Prochaine commande à livrer pour le livreur courant (celle déjà assignée en priorité)."""
+        if not self._get_open_session_id_for_user():
+            return {'status': 'error', 'message': 'Aucune session ouverte'}
+        c = request.env['pos.caisse.commande']._dispatch_next(request.env.uid)
+        if not c:
+            return {'status': 'success', 'data': None}
+        return {'status': 'success', 'data': {
+            'id': c.id,
+            'name': c.name,
+            'client_nom': c.client_name or '',
+            'montant_total': c.montant_total,
+            'montant_restant': c.montant_restant,
+            'priority_livraison': c.priority_livraison or '0',
+            'etat_livraison': c.etat_livraison,
+            'progression': c.progression,
+            'date_assignation': c.date_assignation.isoformat() if c.date_assignation else None,
+        }}
+
+    @http.route('/api/livraison/dashboard', type='json', auth='user', methods=['GET', 'POST'])
+    @query_budget(20)
+    def get_dashboard(self, **params):
+        """Colonnes du tableau de bord par état: nombre, sommes et `limit` premières cartes (défaut 10)."""
+        try:
+            limit = max(0, min(int(params.get('limit', 10)), 100))
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': 'limit invalide'}
+        return read_on_replica(request.env, self._dashboard_payload, limit)
+
+    def _dashboard_payload(self, env, limit):
+        columns = env['pos.caisse.commande']._dashboard_data(limit)
+        for column in columns:
+            column['cards'] = [self._card_to_payload(card) for card in column['cards']]
+        return {'status': 'success', 'data': columns}
+
+    @http.route('/api/livraison/dashboard/cards', type='json', auth='user', methods=['GET', 'POST'])
+    @query_budget(10)
+    def get_dashboard_cards(self, **params):
+        """Cartes suivantes d'une colonne: `etat`, `offset`, `limit` (défaut 20)."""
+        etat = params.get('etat')
+        if etat not in ('en_queue', 'en_cours', 'livree_partielle', 'livree'):
+            return {'status': 'error', 'message': 'etat invalide'}
+        try:
+            offset = max(0, int(params.get('offset', 0)))
+            limit = max(1, min(int(params.get('limit', 20)), 100))
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': 'offset/limit invalide'}
+        return read_on_replica(request.env, self._dashboard_cards_payload, etat, offset, limit)
+
+    def _dashboard_cards_payload(self, env, etat, offset, limit):
+        # Une carte de plus que demandé pour savoir s'il en reste, sans search_count
+        cards = env['pos.caisse.commande']._dashboard_cards(etat, offset=offset, limit=limit + 1)
+        return {'status': 'success', 'data': [self._card_to_payload(card) for card in cards[:limit]],
+                'offset': offset, 'has_more': len(cards) > limit}
+
+    def _card_to_payload(self, card):
+        livreur = card.pop('livreur_assigne_id')
+        card.update({
+            'client_card': card['client_card'] or '',
+            'client_nom': card['client_nom'] or '',
+            'priority_livraison': card['priority_livraison'] or '0',
+            'livreur_assigne_id': livreur[0] if livreur else None,
+            'livreur_assigne': livreur[1] if livreur else None,
+        })
+        return card
+
     @http.route('/api/livraison/stats', type='json', auth='user', methods=['GET'])
+    @query_budget(20)
     def get_stats(self):
-        env = request.env
+        # Session-aware: only show current user's open session activity if present
+        sid = self._get_open_session_id_for_user()
+        return read_on_replica(request.env, self._stats_payload, sid)
+
+    def _stats_payload(self, env, sid):
         model = env['pos.caisse.commande']
         states = ['en_queue', 'en_cours', 'livree_partielle', 'livree']
         counts = {s: model.search_count([('etat_livraison', '=', s)]) for s in states}
         today = fields.Date.today()
-        # Session-aware: only show current user's open session activity if present
-        sid = self._get_open_session_id_for_user()
         liv_domain = [('date', '>=', today)]
         sortie_domain = [('date', '>=', today)]
         if sid:
@@ -433,73 +545,98 @@ class PosLivraisonController(http.Controller):
             }
         }}
 
-    @http.route('/api/livraison/sortie_stock', type='json', auth='user', methods=['POST'])
-    def create_sortie_stock(self, **params):
+    @http.route('/api/livraison/forecast', type='json', auth='user', methods=['GET', 'POST'])
+    @query_budget(10)
+    def get_forecast(self, **params):
+        """Prévisions en cache à partir d'aujourd'hui: `days` jours (défaut 7), regroupement
+        `dimension` (total, type_paiement ou livreur; défaut total)."""
+        try:
+            days = int(params.get('days') or 7)
+        except (TypeError, ValueError):
+            return {'status': 'error', 'message': 'days invalide'}
+        dimension = params.get('dimension') or 'total'
+        if dimension not in ('total', 'type_paiement', 'livreur'):
+            return {'status': 'error', 'message': 'dimension invalide'}
+        return read_on_replica(request.env, self._forecast_payload, days, dimension)
+
+    def _forecast_payload(self, env, days, dimension):
+        today = env['pos.livraison.stat.daily']._local_today()
+        rows = env['pos.livraison.forecast'].search_read([
+            ('date', '>=', today),
+            ('date', '<', today + timedelta(days=days)),
+            ('dimension', '=', dimension),
+        ], ['date', 'cle', 'livreur_id', 'nombre', 'montant', 'sacs', 'livreurs_requis', 'date_calcul'])
+        return {'status': 'success', 'data': [{
+            'date': fields.Date.to_string(r['date']),
+            'cle': r['cle'] or '',
+            'livreur_id': r['livreur_id'][0] if r['livreur_id'] else None,
+            'livreur': r['livreur_id'][1] if r['livreur_id'] else None,
+            'nombre': round(r['nombre'], 1),
+            'montant': round(r['montant'], 2),
+            'sacs': round(r['sacs'], 1),
+            'livreurs_requis': r['livreurs_requis'],
+            'date_calcul': r['date_calcul'].isoformat() if r['date_calcul'] else None,
+        } for r in rows]}
+
+    @http.route('/api/livraison/stock', type='json', auth='user', methods=['GET', 'POST'])
+    @query_budget(15)
+    def get_stock(self, **params):
+        """Stock farine courant, ou à la date `date` (ISO8601) si fournie."""
+        at = params.get('date')
+        try:
+            at = fields.Datetime.to_datetime(at) if at else None
+        except Exception:
+            return {'status': 'error', 'message': 'date invalide'}
+        solde, checkpoint = request.env['pos.livraison.stock.move']._get_balance(at)
+        poids_sac = float(request.env['ir.config_parameter'].sudo().get_param('pos_livraison.poids_sac', '50'))
+        return {'status': 'success', 'data': {
+            'date': (at or fields.Datetime.now()).isoformat(),
+            'solde_sacs': solde,
+            'solde_kg': solde * poids_sac,
+            'checkpoint_date': checkpoint and checkpoint.date.isoformat() or None,
+        }}
+
+    def _unwrap_payload(self, params):
         payload = http.request.jsonrequest or params
         # Unwrap JSON-RPC envelope if present
         if isinstance(payload, dict) and isinstance(payload.get('params'), dict):
             payload = payload['params']
+        return payload
+
+    @http.route('/api/livraison/sortie_stock', type='json', auth='user', methods=['POST'])
+    @query_budget(60)
+    def create_sortie_stock(self, **params):
+        payload = self._unwrap_payload(params)
         logging.info("=========== Creating sortie stock with payload: %s", payload)
         try:
             # Enforce an open session for API usage
             sid = self._get_open_session_id_for_user()
             if not sid:
                 return {'status': 'error', 'code': 'no_open_session', 'message': "Ouvrez d'abord une session de livraison"}
-            motif = payload.get('motif')
-            quantite_sacs = payload.get('quantite_sacs')
-            montant = payload.get('montant')
-            type_sortie = payload.get('type', 'interne')
-            responsable = payload.get('responsable')
-            notes = payload.get('notes')
-            if not motif:
-                return {'status': 'error', 'message': 'motif requis'}
-            # Supporte nouveau parametre 'montant' (prioritaire). Convertit en sacs via prix_sac.
-            prix_sac = float(request.env['ir.config_parameter'].sudo().get_param('pos_livraison.prix_sac', '222000'))
-            if montant not in (None, '', False):
-                try:
-                    montant = float(montant)
-                except Exception:
-                    return {'status': 'error', 'message': 'montant invalide'}
-                if montant <= 0:
-                    return {'status': 'error', 'message': 'montant doit être > 0'}
-                quant_calc = (montant / prix_sac) if prix_sac > 0 else 0.0
-                quantite_sacs = quant_calc
-            else:
-                try:
-                    quantite_sacs = float(quantite_sacs)
-                except Exception:
-                    return {'status': 'error', 'message': 'quantite_sacs invalide'}
-                if quantite_sacs <= 0:
-                    return {'status': 'error', 'message': 'quantite_sacs doit être > 0'}
-                # Si pas de montant fourni, déduire pour la livraison
-                montant = quantite_sacs * prix_sac
-            env = request.env
-            sortie = env['pos.livraison.sortie.stock'].create({
-                'motif': motif,
-                'quantite_sacs': quantite_sacs,
-                'type': type_sortie,
-                'responsable': responsable,
-                'notes': notes,
-                'session_id': sid,
-            })
-            # Créer une livraison liée à la session, marquée comme "sortie de stock" pour les rapports
-            try:
-                sess = env['pos.livraison.session'].browse(sid)
-                livreur_name = sess.user_id.name if sess and sess.exists() else env.user.name
-                liv = env['pos.livraison.livraison'].create({
-                    'commande_id': False,
-                    'session_id': sid,
-                    'montant_livre': float(montant or 0.0),
-                    'type_paiement': 'cash',
-                    'livreur': livreur_name,
-                    'livreur_id': sess.user_id.id if sess and sess.exists() else env.user.id,
-                    'notes': (notes and (notes + ' | ') or '') + f"Sortie de stock: {motif} - {quantite_sacs:.2f} sacs - {montant:.0f} FC",
-                    'is_sortie_stock': True,
-                })
-                # Optional: attach a synthetic commande_name in API layer when commande is False
-            except Exception:
-                liv = None
-            return {'status': 'success', 'sortie_id': sortie.id, 'livraison_id': liv and liv.id}
+            sortie = request.env['pos.livraison.sortie.stock']._create_with_livraisons([payload], session_id=sid)
+            return {'status': 'success', 'sortie_id': sortie.id, 'livraison_id': sortie.livraison_ids[:1].id}
+        except Exception as e:
+            request.env.cr.rollback()
+            return {'status': 'error', 'message': str(e)}
+
+    @http.route('/api/livraison/sortie_stock/batch', type='json', auth='user', methods=['POST'])
+    @query_budget(80)
+    def create_sortie_stock_batch(self, **params):
+        """Crée plusieurs sorties de stock (et leurs livraisons liées) en un seul appel, tout ou rien.
+        Params: sorties: liste de {motif, quantite_sacs | montant, type, responsable, notes}
+        """
+        payload = self._unwrap_payload(params)
+        logging.info("=========== Creating sortie stock batch with payload: %s", payload)
+        try:
+            sid = self._get_open_session_id_for_user()
+            if not sid:
+                return {'status': 'error', 'code': 'no_open_session', 'message': "Ouvrez d'abord une session de livraison"}
+            entries = payload.get('sorties')
+            if not entries or not isinstance(entries, list):
+                return {'status': 'error', 'message': 'sorties requis'}
+            sorties = request.env['pos.livraison.sortie.stock']._create_with_livraisons(entries, session_id=sid)
+            data = [{'sortie_id': s.id, 'name': s.name, 'livraison_id': s.livraison_ids[:1].id} for s in sorties]
+            return {'status': 'success', 'data': data, 'returned': len(data)}
         except Exception as e:
             request.env.cr.rollback()
             return {'status': 'error', 'message': str(e)}
@@ -0,0 +1,76 @@
+"""Lecture des routes de reporting sur une base réplique (lecture seule).
+
+Configuration (fichier de configuration Odoo, sinon paramètres système):
+- pos_livraison_replica_db / pos_livraison.replica_db: nom de base ou URI PostgreSQL de la réplique
+- pos_livraison_replica_max_lag / pos_livraison.replica_max_lag: retard maximal toléré en secondes (défaut 30)
+
+Sans réplique configurée, joignable ou assez fraîche, la lecture se fait sur la base principale.
+"""
+import logging
+from contextlib import contextmanager
+
+import psycopg2
+
+from odoo import api, sql_db
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+
+def _replica_settings(env):
+    params = env['ir.config_parameter'].sudo()
+    target = config.get('pos_livraison_replica_db') or params.get_param('pos_livraison.replica_db')
+    max_lag = config.get('pos_livraison_replica_max_lag') or params.get_param('pos_livraison.replica_max_lag', '30')
+    return target, float(max_lag)
+
+
+@contextmanager
+def _replica_cursor(env):
+    """Curseur en lecture seule sur la réplique, ou None si elle ne doit pas être utilisée."""
+    target, max_lag = _replica_settings(env)
+    cr = None
+    if target:
+        try:
+            # Position WAL de la base principale, lue avant la réplique: celle-ci est à jour si
+            # elle l'a rejouée. Comparer réception et rejeu sur la réplique seule ne suffit pas:
+            # un standby coupé de la principale a tout rejoué de ce qu'il a reçu.
+            with env.cr.savepoint(flush=False):
+                env.cr.execute("SELECT pg_current_wal_lsn()")
+                primary_lsn = env.cr.fetchone()[0]
+            cr = sql_db.db_connect(target, allow_uri=True).cursor()
+            cr.execute("SET TRANSACTION READ ONLY")
+            # Sinon, âge de la dernière transaction rejouée (surestime le retard d'un système inactif)
+            cr.execute("""
+                SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn THEN 0
+                            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+                       END
+            """, (primary_lsn,))
+            lag = cr.fetchone()[0]
+            if lag is None or lag > max_lag:
+                _logger.info("Réplique %s en retard (%s s > %s s), lecture sur la base principale", target, lag, max_lag)
+                cr.close()
+                cr = None
+        except Exception:
+            _logger.warning("Réplique %s indisponible, lecture sur la base principale", target, exc_info=True)
+            if cr is not None:
+                cr.close()
+            cr = None
+    try:
+        yield cr
+    finally:
+        if cr is not None:
+            cr.close()
+
+
+def read_on_replica(env, func, *args, **kwargs):
+    """Appelle `func(env, *args, **kwargs)` avec un environnement sur la réplique si possible,
+    et se replie sur `env` (base principale) en cas d'erreur de la réplique."""
+    with _replica_cursor(env) as cr:
+        if cr is not None:
+            cr.transaction = api.Transaction(env.registry)
+            replica_env = api.Environment(cr, env.uid, env.context)
+            try:
+                return func(replica_env, *args, **kwargs)
+            except psycopg2.Error:
+                _logger.warning("Erreur sur la réplique, lecture sur la base principale", exc_info=True)
+    return func(env, *args, **kwargs)
@@ -0,0 +1,9 @@
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Journalise l'historique existant (livraisons, sorties) dans le journal de stock."""
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['pos.livraison.stock.move']._backfill_from_history()
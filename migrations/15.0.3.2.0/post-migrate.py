@@ -0,0 +1,39 @@
+def migrate(cr, version):
+    """Renseigne motif / sortie_id / type_sortie des livraisons issues de sorties de stock.
+    Le motif est extrait en masse des notes ("... Sortie de stock: <MOTIF> - <qty> sacs - <montant> FC"),
+    puis chaque livraison est rattachée à la sortie de même session et même motif la plus proche dans le temps.
+    """
+    if not version:
+        return
+    cr.execute("""
+        UPDATE pos_livraison_livraison
+           SET motif = NULLIF(btrim(split_part(
+                   substring(notes FROM position('Sortie de stock:' IN notes) + length('Sortie de stock:')),
+                   ' - ', 1)), '')
+         WHERE is_sortie_stock
+           AND motif IS NULL
+           AND position('Sortie de stock:' IN notes) > 0
+    """)
+    cr.execute("""
+        UPDATE pos_livraison_livraison l
+           SET sortie_id = m.sortie_id
+          FROM (
+                SELECT DISTINCT ON (l2.id) l2.id AS livraison_id, s.id AS sortie_id
+                  FROM pos_livraison_livraison l2
+                  JOIN pos_livraison_sortie_stock s
+                    ON s.session_id IS NOT DISTINCT FROM l2.session_id
+                   AND s.motif = l2.motif
+                 WHERE l2.is_sortie_stock
+                   AND l2.sortie_id IS NULL
+              ORDER BY l2.id, abs(extract(epoch FROM s.date - l2.date))
+               ) m
+         WHERE l.id = m.livraison_id
+    """)
+    cr.execute("""
+        UPDATE pos_livraison_livraison l
+           SET type_sortie = s.type,
+               motif = COALESCE(l.motif, s.motif)
+          FROM pos_livraison_sortie_stock s
+         WHERE l.sortie_id = s.id
+           AND l.type_sortie IS NULL
+    """)
@@ -0,0 +1,21 @@
+def migrate(cr, version):
+    """Point de départ de l'historique des états: un événement par commande existante.
+    Entrée exacte pour les commandes en file (création), sinon dernière date connue
+    (livraison complète ou dernière modification).
+    """
+    if not version:
+        return
+    cr.execute("""
+        INSERT INTO pos_livraison_state_event
+               (commande_id, etat_avant, etat_apres, date, user_id, progression,
+                create_uid, create_date, write_uid, write_date)
+        SELECT c.id, NULL, c.etat_livraison,
+               COALESCE(CASE WHEN c.etat_livraison = 'en_queue' THEN c.create_date
+                             WHEN c.etat_livraison = 'livree' THEN COALESCE(c.date_livraison_complete, c.write_date)
+                             ELSE c.write_date END, now() at time zone 'UTC'),
+               c.write_uid, COALESCE(c.progression, 0),
+               1, now() at time zone 'UTC', 1, now() at time zone 'UTC'
+          FROM pos_caisse_commande c
+         WHERE c.etat_livraison IS NOT NULL
+           AND NOT EXISTS (SELECT 1 FROM pos_livraison_state_event e WHERE e.commande_id = c.id)
+    """)
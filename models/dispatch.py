@@ -0,0 +1,68 @@
+import heapq
+import threading
+
+
+class DispatchHeap:
+    """Tas min des commandes à répartir, partagé par les requêtes d'un même processus.
+    Clé: (-priorité, date de création, -montant restant, id): la plus urgente, puis la plus
+    ancienne, puis la plus grosse. Une mise à jour remplace l'entrée courante; les entrées
+    périmées restent dans le tas et sont ignorées au dépilement (suppression paresseuse).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.synced_at = None
+        self.rebuilt_at = None
+        self._heap = []
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._heap = []
+        self._entries = {}
+
+    def reset(self):
+        """Vide le tas et force une reconstruction complète à la prochaine synchronisation."""
+        with self.lock:
+            self.clear()
+            self.synced_at = self.rebuilt_at = None
+
+    def push(self, commande_id, key):
+        self.discard(commande_id)
+        entry = [key, commande_id, True]
+        self._entries[commande_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def discard(self, commande_id):
+        entry = self._entries.pop(commande_id, None)
+        if entry:
+            entry[2] = False
+
+    def pop(self):
+        """Retire et retourne `(clé, id)` de la première entrée valide, ou None."""
+        while self._heap:
+            key, commande_id, valid = heapq.heappop(self._heap)
+            if valid:
+                del self._entries[commande_id]
+                return key, commande_id
+        return None
+
+    def restore(self, commande_id, key):
+        """Remet une entrée dépilée dont l'assignation a été annulée, sauf si une
+        synchronisation l'a déjà remplacée entre-temps."""
+        with self.lock:
+            if commande_id not in self._entries:
+                self.push(commande_id, key)
+
+
+# Un tas par base de données et par processus
+HEAPS = {}
+
+
+def get_heap(dbname):
+    heap = HEAPS.get(dbname)
+    if heap is None:
+        heap = HEAPS.setdefault(dbname, DispatchHeap())
+    return heap
@@ -0,0 +1,42 @@
+"""Modèle saisonnier simple (niveau lissé x indice hebdomadaire), vectorisé sur toutes les séries."""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PERIOD = 7
+
+
+def seasonal_forecast(matrix, horizon, period=PERIOD, alpha=0.3):
+    """Prévision de `horizon` jours pour chaque ligne de `matrix` (séries x jours, jours
+    consécutifs se terminant hier, complétés par des zéros).
+
+    Seules les périodes complètes les plus récentes sont utilisées. L'indice saisonnier d'un
+    jour de la semaine est sa moyenne rapportée à la moyenne de la série; le niveau est la
+    moyenne des valeurs désaisonnalisées, pondérée exponentiellement (poids `1 - alpha` par
+    jour d'ancienneté) en ignorant les jours sans activité habituelle. Retourne un tableau
+    séries x horizon, positif ou nul.
+    """
+    values = np.asarray(matrix, dtype=float)
+    n_series, n_days = values.shape
+    cycles = n_days // period
+    if not n_series or not cycles:
+        return np.zeros((n_series, horizon))
+    values = values[:, n_days - cycles * period:]
+    days = values.shape[1]
+
+    mean = values.mean(axis=1, keepdims=True)
+    season = np.divide(values.reshape(n_series, cycles, period).mean(axis=1), mean,
+                       out=np.ones((n_series, period)), where=mean > 0)
+    season_by_day = np.tile(season, cycles)
+    active = season_by_day > 0
+    deseasonalized = np.divide(values, season_by_day, out=np.zeros_like(values), where=active)
+
+    weights = (1.0 - alpha) ** np.arange(days - 1, -1, -1)
+    weighted = weights * active
+    total = weighted.sum(axis=1)
+    level = np.divide((deseasonalized * weighted).sum(axis=1), total,
+                      out=np.zeros(n_series), where=total > 0)
+
+    future = (days + np.arange(horizon)) % period
+    return np.maximum(level[:, None] * season[:, future], 0.0)
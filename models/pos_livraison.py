@@ -1,5 +1,82 @@
+import heapq
+import json
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
 from odoo import models, fields, api, exceptions
-from datetime import datetime, timedelta
+from odoo.osv import expression
+
+from .dispatch import get_heap
+from .forecast import np, seasonal_forecast
+
+_logger = logging.getLogger(__name__)
+
+# États d'une commande encore à la charge du livreur qui l'a reçue
+ETATS_ACTIFS = ('en_queue', 'en_cours', 'livree_partielle')
+# Colonnes du tableau de bord ('livree' limitée aux commandes complétées aujourd'hui) et champs d'une carte
+ETATS_DASHBOARD = ETATS_ACTIFS + ('livree',)
+CHAMPS_CARTE = ['name', 'client_card', 'client_nom', 'etat_livraison', 'priority_livraison', 'montant_total',
+                'montant_livre', 'montant_restant', 'sacs_farine_total', 'progression', 'livreur_assigne_id']
+# Marge de resynchronisation du tas de répartition (transactions longues) et reconstruction complète
+DISPATCH_SYNC_MARGIN = timedelta(minutes=2)
+DISPATCH_REBUILD_INTERVAL = timedelta(minutes=15)
+# Délai au-delà duquel une commande assignée mais non prise en charge retourne dans la file
+DISPATCH_ASSIGN_TIMEOUT = timedelta(minutes=30)
+
+TYPES_SORTIE = [
+    ('interne', 'Usage interne'), ('abime', 'Produit abîmé'), ('perte', 'Perte'), ('don', 'Don'), ('autres', 'Autres')
+]
+
+
+def _ensure_indexes(cr, table, indexes):
+    """Crée les index `{nom: définition}` absents de `table` (index composites et partiels
+    des requêtes chaudes, que les champs `index=True` ne couvrent pas)."""
+    for name, definition in indexes.items():
+        cr.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}")
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @api.model
+    def _next_by_code_batch(self, sequence_code, count):
+        """Réserve `count` références consécutives de la séquence `sequence_code` en une
+        requête (au lieu d'un `next_by_code` par enregistrement)."""
+        if count <= 0:
+            return []
+        self.check_access_rights('read')
+        company_id = self.env.company.id
+        seq = self.sudo().search([('code', '=', sequence_code), ('company_id', 'in', [company_id, False])],
+                                 order='company_id', limit=1)
+        if not seq:
+            return [False] * count
+        if not seq.use_date_range:
+            numbers = seq._reserve_numbers('ir_sequence_%03d' % seq.id, seq, count)
+            return [seq.get_next_char(number) for number in numbers]
+        # Même choix de plage de dates que `_next()`, une seule réservation pour le lot
+        dt = self.env.context.get('ir_sequence_date', fields.Date.today())
+        seq_date = self.env['ir.sequence.date_range'].sudo().search([
+            ('sequence_id', '=', seq.id), ('date_from', '<=', dt), ('date_to', '>=', dt),
+        ], limit=1) or seq._create_date_range_seq(dt)
+        numbers = seq._reserve_numbers('ir_sequence_%03d_%03d' % (seq.id, seq_date.id), seq_date, count)
+        seq = seq.with_context(ir_sequence_date_range=seq_date.date_from)
+        return [seq.get_next_char(number) for number in numbers]
+
+    def _reserve_numbers(self, pg_sequence, counter, count):
+        """`count` numéros suivants. Implémentation standard: séquence PostgreSQL native, sans
+        verrou entre transactions concurrentes. Sans trou: un UPDATE sur la ligne de `counter`
+        (séquence ou plage de dates), verrouillée jusqu'au commit pour tout le lot."""
+        step = self.number_increment
+        if self.implementation == 'standard':
+            self.env.cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)", (pg_sequence, count))
+            return [row[0] for row in self.env.cr.fetchall()]
+        self.env.cr.execute(f"UPDATE {counter._table} SET number_next = number_next + %s WHERE id = %s RETURNING number_next",
+                            (step * count, counter.id))
+        end = self.env.cr.fetchone()[0]
+        counter.invalidate_cache(['number_next'])
+        return [end - step * (count - i) for i in range(count)]
 
 
 class PosCommande(models.Model):
@@ -39,6 +116,22 @@ class PosCommande(models.Model):
     progression = fields.Float('Progression (%)', compute='_compute_progression', store=True)
     last_progress_threshold = fields.Integer('Dernier seuil notifié', default=0, copy=False)
     montant_bp = fields.Float('Montant BP (fin de mois)', default=0.0)
+    livreur_assigne_id = fields.Many2one('res.users', string='Livreur assigné', index=True, copy=False)
+    date_assignation = fields.Datetime('Assignée le', copy=False)
+
+    def init(self):
+        super().init()
+        actifs = "etat_livraison IN ('en_queue', 'en_cours', 'livree_partielle')"
+        _ensure_indexes(self.env.cr, self._table, {
+            # File et colonnes du tableau de bord: un état, tri priorité puis ancienneté
+            'pos_caisse_commande_etat_actif_idx': f"(etat_livraison, priority_livraison DESC, create_date, id) WHERE {actifs}",
+            # Liste des commandes actives tous états confondus, même tri
+            'pos_caisse_commande_actif_priorite_idx': f"(priority_livraison DESC, create_date, id) WHERE {actifs}",
+            # Colonne « livrées aujourd'hui »
+            'pos_caisse_commande_livree_date_idx': "(date_livraison_complete) WHERE etat_livraison = 'livree'",
+            # Synchronisation incrémentale du tas de répartition
+            'pos_caisse_commande_write_date_idx': "(write_date)",
+        })
 
     @api.depends('livraison_ids.montant_livre')
     def _compute_montant_livre(self):
@@ -163,20 +256,220 @@ class PosCommande(models.Model):
         old_states = {rec.id: rec.etat_livraison for rec in self}
         res = super().write(vals)
         if 'etat_livraison' in vals:
+            transitions = {}
             for rec in self:
                 old_state = old_states.get(rec.id)
                 if rec.etat_livraison != old_state:
                     if rec.etat_livraison == 'livree' and getattr(rec, 'state', False) and rec.state != 'livre':
                         if rec.state != 'annule':
                             rec.write({'state': 'livre', 'date_livraison_complete': rec.date_livraison_complete or fields.Datetime.now()})
-                    message = {
-                        'commande_id': rec.id,
-                        'old_state': old_state,
-                        'new_state': rec.etat_livraison,
-                    }
-                    rec._bus_notify('pos_livraison_state', message, rec.id)
+                    transitions[rec.id] = old_state
+            if transitions:
+                changed = self.browse(list(transitions))
+                self.env['pos.livraison.state.event'].sudo()._record_transitions(changed, transitions)
+                self.env['pos.livraison.job']._enqueue(changed, '_job_notify_state', old_states=transitions)
+                self.env['pos.livraison.job']._enqueue(changed, '_job_dispatch')
         return res
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        recs = super().create(vals_list)
+        self.env['pos.livraison.state.event'].sudo()._record_transitions(recs.filtered('etat_livraison'))
+        queued = recs.filtered(lambda r: r.etat_livraison == 'en_queue')
+        if queued:
+            self.env['pos.livraison.job']._enqueue(queued, '_job_dispatch')
+        return recs
+
+    def _job_notify_state(self, old_states):
+        # Les clés JSON sont des chaînes
+        old_states = {int(k): v for k, v in old_states.items()}
+        for rec in self:
+            message = {
+                'commande_id': rec.id,
+                'old_state': old_states.get(rec.id),
+                'new_state': rec.etat_livraison,
+            }
+            rec._bus_notify('pos_livraison_state', message, rec.id)
+
+    # ==== Tableau de bord ====
+    @api.model
+    def _dashboard_domain(self, etat=None):
+        """Commandes affichées dans la colonne `etat` (toutes les colonnes si `etat` est vide)."""
+        local_now = fields.Datetime.context_timestamp(self, fields.Datetime.now())
+        today_start = local_now.replace(hour=0, minute=0, second=0, microsecond=0)
+        livree_today = ['&', ('etat_livraison', '=', 'livree'),
+                        ('date_livraison_complete', '>=', today_start.astimezone(timezone.utc).replace(tzinfo=None))]
+        if etat == 'livree':
+            return livree_today
+        if etat:
+            return [('etat_livraison', '=', etat)]
+        return ['|', ('etat_livraison', 'in', ETATS_ACTIFS)] + livree_today
+
+    @api.model
+    def _dashboard_cards(self, etat, offset=0, limit=10):
+        return self.search_read(self._dashboard_domain(etat), CHAMPS_CARTE, offset=offset, limit=limit,
+                                order='priority_livraison desc, create_date asc, id')
+
+    @api.model
+    def _dashboard_data(self, limit=10):
+        """Colonnes du tableau de bord: nombre et sommes par état (un seul read_group) et
+        les `limit` premières cartes de chaque colonne; la suite via `_dashboard_cards`."""
+        groups = self.read_group(
+            self._dashboard_domain(),
+            ['montant_total:sum', 'montant_livre:sum', 'montant_restant:sum', 'sacs_farine_total:sum'],
+            ['etat_livraison'], lazy=False,
+        )
+        by_etat = {g['etat_livraison']: g for g in groups}
+        labels = dict(self._fields['etat_livraison']._description_selection(self.env))
+        columns = []
+        for etat in ETATS_DASHBOARD:
+            group = by_etat.get(etat, {})
+            count = group.get('__count', 0)
+            cards = self._dashboard_cards(etat, limit=limit) if count and limit else []
+            columns.append({
+                'etat': etat,
+                'label': labels.get(etat, etat),
+                'count': count,
+                'montant_total': group.get('montant_total') or 0.0,
+                'montant_livre': group.get('montant_livre') or 0.0,
+                'montant_restant': group.get('montant_restant') or 0.0,
+                'sacs_farine_total': group.get('sacs_farine_total') or 0.0,
+                'cards': cards,
+                'has_more': count > len(cards),
+            })
+        return columns
+
+    # ==== Répartition des commandes en file entre les livreurs ====
+    @api.model
+    def _dispatch_key(self, row):
+        return (-int(row['priority_livraison'] or 0), row['create_date'], -(row['montant_restant'] or 0.0), row['id'])
+
+    @api.model
+    def _dispatch_heap(self):
+        """Tas des commandes en file non assignées, mis à jour de façon incrémentale à partir
+        des commandes modifiées depuis la dernière synchronisation (tous workers confondus).
+        Le verrou du tas n'est tenu que pour les opérations en mémoire, pas pendant la requête."""
+        heap = get_heap(self.env.cr.dbname)
+        fnames = ['etat_livraison', 'priority_livraison', 'create_date', 'montant_restant', 'livreur_assigne_id']
+        with heap.lock:
+            now = fields.Datetime.now()
+            rebuild = not heap.rebuilt_at or now - heap.rebuilt_at > DISPATCH_REBUILD_INTERVAL
+            if rebuild:
+                heap.rebuilt_at = now
+                domain = [('etat_livraison', '=', 'en_queue'), ('livreur_assigne_id', '=', False)]
+            else:
+                domain = [('write_date', '>=', heap.synced_at - DISPATCH_SYNC_MARGIN)]
+            heap.synced_at = now
+        rows = self.sudo().search_read(domain, fnames)
+        with heap.lock:
+            if rebuild:
+                heap.clear()
+            for row in rows:
+                if row['etat_livraison'] == 'en_queue' and not row['livreur_assigne_id']:
+                    heap.push(row['id'], self._dispatch_key(row))
+                else:
+                    heap.discard(row['id'])
+        return heap
+
+    def _dispatch_claim(self, user_id):
+        """Assigne la commande à `user_id` si elle est toujours en file et libre (atomique entre
+        workers). Ne bloque pas: une commande verrouillée par une autre transaction (livraison
+        en cours) n'est pas assignée, elle revient dans le tas à la synchronisation suivante."""
+        self.ensure_one()
+        self.flush(['etat_livraison', 'livreur_assigne_id'])
+        self.env.cr.execute("""
+            UPDATE pos_caisse_commande
+               SET livreur_assigne_id = %s, date_assignation = now() at time zone 'UTC',
+                   write_uid = %s, write_date = now() at time zone 'UTC'
+             WHERE id = (SELECT id FROM pos_caisse_commande
+                          WHERE id = %s AND etat_livraison = 'en_queue' AND livreur_assigne_id IS NULL
+                            FOR UPDATE SKIP LOCKED)
+         RETURNING id
+        """, (user_id, self.env.uid, self.id))
+        claimed = bool(self.env.cr.fetchone())
+        if claimed:
+            self.invalidate_cache(['livreur_assigne_id', 'date_assignation', 'write_uid', 'write_date'])
+        return claimed
+
+    @api.model
+    def _dispatch_pop(self, heap, user_id):
+        """Dépile et assigne à `user_id` la première commande encore libre. L'entrée retirée du
+        tas (partagé par le processus) y est remise si l'assignation échoue ou si la transaction
+        est annulée avant son commit."""
+        while True:
+            with heap.lock:
+                entry = heap.pop()
+            if not entry:
+                return self.browse()
+            key, commande_id = entry
+            commande = self.browse(commande_id)
+            try:
+                claimed = commande._dispatch_claim(user_id)
+            except Exception:
+                heap.restore(commande_id, key)
+                raise
+            if claimed:
+                self.env.cr.postrollback.add(lambda: heap.restore(commande_id, key))
+                return commande
+
+    @api.model
+    def _dispatch_next(self, user_id):
+        """Commande à livrer pour `user_id`: celle qui lui est déjà assignée, sinon la première du tas."""
+        current = self.search([('livreur_assigne_id', '=', user_id), ('etat_livraison', 'in', ETATS_ACTIFS)],
+                              order='date_assignation, id', limit=1)
+        if current:
+            if current.etat_livraison == 'en_queue':
+                # Le livreur la réclame: elle ne doit pas expirer
+                current.sudo().date_assignation = fields.Datetime.now()
+            return current
+        self._dispatch_release()
+        return self._dispatch_pop(self._dispatch_heap(), user_id)
+
+    @api.model
+    def _dispatch_release(self, user_ids=None):
+        """Libère les commandes non livrées assignées à `user_ids` (session fermée), et celles
+        assignées depuis plus de DISPATCH_ASSIGN_TIMEOUT sans prise en charge. La mise à jour
+        de `write_date` les remet dans le tas à la synchronisation suivante."""
+        domain = [('etat_livraison', '=', 'en_queue'), ('livreur_assigne_id', '!=', False),
+                  ('date_assignation', '<', fields.Datetime.now() - DISPATCH_ASSIGN_TIMEOUT)]
+        if user_ids:
+            domain = expression.OR([domain, [('livreur_assigne_id', 'in', list(user_ids)),
+                                             ('etat_livraison', 'in', ETATS_ACTIFS)]])
+        commandes = self.sudo().search(domain)
+        if commandes:
+            commandes.write({'livreur_assigne_id': False, 'date_assignation': False})
+        return commandes
+
+    @api.model
+    def _dispatch_assign_open_sessions(self):
+        """Assigne une commande à chaque livreur de session ouverte qui n'en a pas, le moins
+        chargé d'abord (montant puis nombre de livraisons de sa session)."""
+        self._dispatch_release()
+        sessions = self.env['pos.livraison.session'].sudo().search([('state', '=', 'ouvert')])
+        if not sessions:
+            return self.browse()
+        busy = self.sudo().search([('livreur_assigne_id', 'in', sessions.mapped('user_id').ids),
+                                   ('etat_livraison', 'in', ETATS_ACTIFS)]).mapped('livreur_assigne_id')
+        loads = {}
+        for sess in sessions:
+            if sess.user_id not in busy:
+                load = (sess.montant_livre_total, sess.total_livraisons)
+                loads[sess.user_id.id] = max(loads.get(sess.user_id.id, load), load)
+        drivers = [(load, uid) for uid, load in loads.items()]
+        heapq.heapify(drivers)
+        assigned = self.browse()
+        heap = self._dispatch_heap()
+        while drivers:
+            _load, uid = heapq.heappop(drivers)
+            commande = self._dispatch_pop(heap, uid)
+            if not commande:
+                break
+            assigned |= commande
+        return assigned
+
+    def _job_dispatch(self):
+        self.env['pos.caisse.commande'].sudo()._dispatch_assign_open_sessions()
+
     def _bus_notify(self, channel, payload, rec_id=None):
         try:
             bus = self.env['bus.bus']
@@ -239,36 +532,60 @@ class LivraisonLivraison(models.Model):
     notes = fields.Text('Notes de livraison')
     sacs_farine = fields.Float('Sacs de farine', compute='_compute_sacs_farine', store=True)
     is_sortie_stock = fields.Boolean('Issue de sortie de stock', default=False, index=True, help="Créée automatiquement depuis une sortie de stock")
+    sortie_id = fields.Many2one('pos.livraison.sortie.stock', string='Sortie de stock', ondelete='set null', index=True)
+    motif = fields.Char('Motif (sortie de stock)', index=True)
+    type_sortie = fields.Selection(TYPES_SORTIE, string='Type de sortie', index=True)
     livraison_session_id = fields.Many2one('pos.livraison.session', string='Session livraison (alias)', related='session_id', store=True, index=True)
     livreur_id = fields.Many2one('res.users', string='Livreur (utilisateur)', index=True)
 
-    @api.model
-    def create(self, vals):
-        if vals.get('name', 'Nouveau') == 'Nouveau':
-            vals['name'] = self.env['ir.sequence'].next_by_code('pos.livraison.livraison') or 'Nouveau'
-        if not vals.get('session_id'):
-            sid = vals.get('livraison_session_id') or self.env['pos.livraison.session']._ensure_open_for_user(self.env.uid)
-            vals['session_id'] = sid
-        if not vals.get('livreur_id'):
-            try:
-                sess = self.env['pos.livraison.session'].browse(vals.get('session_id'))
-                vals['livreur_id'] = (sess.user_id.id if sess and sess.exists() else self.env.uid)
-            except Exception:
-                vals['livreur_id'] = self.env.uid
-        commande = None
-        if vals.get('commande_id'):
-            commande = self.env['pos.caisse.commande'].browse(vals['commande_id'])
-            if commande and commande.exists():
-                # Valider contre le montant cible (VC => +25%)
+    def init(self):
+        super().init()
+        _ensure_indexes(self.env.cr, self._table, {
+            'pos_livraison_livraison_session_date_idx': "(session_id, date DESC)",
+            'pos_livraison_livraison_commande_date_idx': "(commande_id, date DESC)",
+        })
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        unnamed = [vals for vals in vals_list if vals.get('name', 'Nouveau') == 'Nouveau']
+        if unnamed:
+            names = self.env['ir.sequence']._next_by_code_batch('pos.livraison.livraison', len(unnamed))
+            for vals, name in zip(unnamed, names):
+                vals['name'] = name or 'Nouveau'
+        commandes = self.env['pos.caisse.commande']
+        for vals in vals_list:
+            if not vals.get('session_id'):
+                sid = vals.get('livraison_session_id') or self.env['pos.livraison.session']._ensure_open_for_user(self.env.uid)
+                vals['session_id'] = sid
+            if not vals.get('livreur_id'):
                 try:
-                    add = float(vals.get('montant_livre') or 0.0)
+                    sess = self.env['pos.livraison.session'].browse(vals.get('session_id'))
+                    vals['livreur_id'] = (sess.user_id.id if sess and sess.exists() else self.env.uid)
                 except Exception:
-                    add = 0.0
-                target = getattr(commande, 'montant_cible', None) or commande.montant_total or 0.0
-                if (commande.montant_livre or 0.0) + add > target + 0.01:
-                    raise exceptions.UserError('Le montant cumulé des livraisons dépasse le total cible de la commande.')
-        rec = super().create(vals)
-        if rec.commande_id:
+                    vals['livreur_id'] = self.env.uid
+            if vals.get('commande_id'):
+                commande = self.env['pos.caisse.commande'].browse(vals['commande_id'])
+                if commande and commande.exists():
+                    # Valider contre le montant cible (VC => +25%)
+                    try:
+                        add = float(vals.get('montant_livre') or 0.0)
+                    except Exception:
+                        add = 0.0
+                    target = getattr(commande, 'montant_cible', None) or commande.montant_total or 0.0
+                    if (commande.montant_livre or 0.0) + add > target + 0.01:
+                        raise exceptions.UserError('Le montant cumulé des livraisons dépasse le total cible de la commande.')
+                    commandes |= commande
+        recs = super().create(vals_list)
+        self.env['pos.livraison.stock.move']._record_livraisons(recs)
+        if commandes:
+            # L'état de la commande suit la livraison immédiatement, comme dans `write`;
+            # seules les notifications (bus, seuils) sont traitées hors requête
+            commandes._update_state_from_progress()
+            self.env['pos.livraison.job']._enqueue(recs.filtered('commande_id'), '_job_after_create')
+        return recs
+
+    def _job_after_create(self):
+        for rec in self.filtered('commande_id'):
             message = {
                 'commande_id': rec.commande_id.id,
                 'livraison_id': rec.id,
@@ -277,15 +594,13 @@ class LivraisonLivraison(models.Model):
                 'etat_livraison': rec.commande_id.etat_livraison,
             }
             rec.commande_id._bus_notify('pos_livraison_new_livraison', message, rec.commande_id.id)
-        if commande:
-            commande._update_state_from_progress()
-            commande._notify_progress_thresholds()
-        return rec
+        self.mapped('commande_id')._notify_progress_thresholds()
 
     @api.depends('montant_livre')
     def _compute_prix_sac(self):
+        prix_sac = float(self.env['ir.config_parameter'].sudo().get_param('pos_livraison.prix_sac', '222000'))
         for rec in self:
-            rec.prix_sac = float(self.env['ir.config_parameter'].sudo().get_param('pos_livraison.prix_sac', '222000'))
+            rec.prix_sac = prix_sac
 
     @api.depends('montant_livre', 'prix_sac')
     def _compute_sacs_farine(self):
@@ -297,13 +612,20 @@ class LivraisonLivraison(models.Model):
             sess = self.env['pos.livraison.session'].browse(vals['session_id'])
             if sess and sess.state == 'ferme':
                 raise exceptions.UserError("Impossible d'attacher une livraison à une session fermée.")
+        previous_sacs = {rec.id: rec.sacs_farine for rec in self} if 'montant_livre' in vals else None
         res = super().write(vals)
         for rec in self:
             if rec.commande_id:
                 rec.commande_id._update_state_from_progress()
                 rec.commande_id._notify_progress_thresholds()
+        if previous_sacs is not None:
+            self.env['pos.livraison.stock.move']._record_livraisons(self, previous=previous_sacs)
         return res
 
+    def unlink(self):
+        self.env['pos.livraison.stock.move']._record_livraisons(self, reverse=True)
+        return super().unlink()
+
     @api.onchange('commande_id')
     def _onchange_commande_id(self):
         if self.commande_id:
@@ -324,26 +646,114 @@ class LivraisonSortieStock(models.Model):
     quantite_sacs = fields.Float('Quantité (sacs)', required=True)
     quantite_kg = fields.Float('Quantité (kg)', compute='_compute_quantite_kg', store=True)
     montant = fields.Float('Montant', compute='_compute_quantite_kg', store=True)
-    type = fields.Selection([
-        ('interne', 'Usage interne'), ('abime', 'Produit abîmé'), ('perte', 'Perte'), ('don', 'Don'), ('autres', 'Autres')
-    ], default='interne', string='Type de sortie', required=True, index=True)
+    type = fields.Selection(TYPES_SORTIE, default='interne', string='Type de sortie', required=True, index=True)
     responsable = fields.Char('Responsable')
     notes = fields.Text('Notes')
     validated = fields.Boolean('Validée', default=False, index=True)
+    livraison_ids = fields.One2many('pos.livraison.livraison', 'sortie_id', string='Livraisons liées')
 
-    @api.model
-    def create(self, vals):
-        if vals.get('name', 'Nouveau') == 'Nouveau':
-            vals['name'] = self.env['ir.sequence'].next_by_code('pos.livraison.sortie') or 'Nouveau'
-        if not vals.get('session_id'):
+    def init(self):
+        super().init()
+        _ensure_indexes(self.env.cr, self._table, {
+            'pos_livraison_sortie_stock_session_date_idx': "(session_id, date DESC)",
+        })
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        unnamed = [vals for vals in vals_list if vals.get('name', 'Nouveau') == 'Nouveau']
+        if unnamed:
+            names = self.env['ir.sequence']._next_by_code_batch('pos.livraison.sortie', len(unnamed))
+            for vals, name in zip(unnamed, names):
+                vals['name'] = name or 'Nouveau'
+        if any(not vals.get('session_id') for vals in vals_list):
             sid = self.env['pos.livraison.session']._ensure_open_for_user(self.env.uid)
-            vals['session_id'] = sid
-        return super().create(vals)
+            for vals in vals_list:
+                if not vals.get('session_id'):
+                    vals['session_id'] = sid
+        recs = super().create(vals_list)
+        self.env['pos.livraison.stock.move']._record_sorties(recs)
+        return recs
+
+    @api.model
+    def _create_with_livraisons(self, entries, session_id=None):
+        """Crée atomiquement, pour chaque entrée, une sortie de stock et sa livraison liée
+        (marquée `is_sortie_stock` pour les rapports).
+        Entrées: dicts {motif, quantite_sacs ou montant (prioritaire), type, responsable, notes}.
+        Une seule résolution de session, une seule lecture du prix du sac et une réservation
+        groupée des références SOR-/LP-. Toute erreur annule l'ensemble du lot.
+        """
+        Session = self.env['pos.livraison.session']
+        sess = Session.browse(session_id or Session._ensure_open_for_user(self.env.uid))
+        livreur = sess.user_id if sess.exists() else self.env.user
+        prix_sac = float(self.env['ir.config_parameter'].sudo().get_param('pos_livraison.prix_sac', '222000'))
+        prepared = []
+        for index, entry in enumerate(entries, start=1):
+            prefix = len(entries) > 1 and f"Sortie {index}: " or ''
+            motif = entry.get('motif')
+            if not motif:
+                raise exceptions.UserError(prefix + 'motif requis')
+            montant = entry.get('montant')
+            # Supporte le parametre 'montant' (prioritaire). Convertit en sacs via prix_sac.
+            if montant not in (None, '', False):
+                try:
+                    montant = float(montant)
+                except Exception:
+                    raise exceptions.UserError(prefix + 'montant invalide')
+                if montant <= 0:
+                    raise exceptions.UserError(prefix + 'montant doit être > 0')
+                quantite_sacs = (montant / prix_sac) if prix_sac > 0 else 0.0
+            else:
+                try:
+                    quantite_sacs = float(entry.get('quantite_sacs'))
+                except Exception:
+                    raise exceptions.UserError(prefix + 'quantite_sacs invalide')
+                if quantite_sacs <= 0:
+                    raise exceptions.UserError(prefix + 'quantite_sacs doit être > 0')
+                montant = quantite_sacs * prix_sac
+            prepared.append((entry, motif, quantite_sacs, montant))
+        with self.env.cr.savepoint():
+            sorties = self.create([{
+                'motif': motif,
+                'quantite_sacs': quantite_sacs,
+                'type': entry.get('type') or 'interne',
+                'responsable': entry.get('responsable'),
+                'notes': entry.get('notes'),
+                'session_id': sess.id,
+            } for entry, motif, quantite_sacs, _montant in prepared])
+            self.env['pos.livraison.livraison'].create([{
+                'commande_id': False,
+                'session_id': sess.id,
+                'montant_livre': montant,
+                'type_paiement': 'cash',
+                'livreur': livreur.name,
+                'livreur_id': livreur.id,
+                'notes': (entry.get('notes') and (entry['notes'] + ' | ') or '') + f"Sortie de stock: {motif} - {quantite_sacs:.2f} sacs - {montant:.0f} FC",
+                'is_sortie_stock': True,
+                'sortie_id': sortie.id,
+                'motif': motif,
+                'type_sortie': sortie.type,
+            } for sortie, (entry, motif, quantite_sacs, montant) in zip(sorties, prepared)])
+        return sorties
+
+    def write(self, vals):
+        previous_sacs = {rec.id: rec.quantite_sacs for rec in self} if 'quantite_sacs' in vals else None
+        res = super().write(vals)
+        if previous_sacs is not None:
+            self.env['pos.livraison.stock.move']._record_sorties(self, previous=previous_sacs)
+        # Motif et type recopiés sur les livraisons liées (listes et détail de commande)
+        synced = {fname: vals[key] for key, fname in (('motif', 'motif'), ('type', 'type_sortie')) if key in vals}
+        if synced and self.livraison_ids:
+            self.livraison_ids.sudo().write(synced)
+        return res
+
+    def unlink(self):
+        self.env['pos.livraison.stock.move']._record_sorties(self, reverse=True)
+        return super().unlink()
 
     @api.depends('quantite_sacs')
     def _compute_quantite_kg(self):
+        poids_par_sac = float(self.env['ir.config_parameter'].sudo().get_param('pos_livraison.poids_sac', '50'))
         for rec in self:
-            poids_par_sac = float(self.env['ir.config_parameter'].sudo().get_param('pos_livraison.poids_sac', '50'))
             rec.quantite_kg = rec.quantite_sacs * poids_par_sac
             rec.montant = (rec.quantite_sacs*444) * 500
 
@@ -386,6 +796,16 @@ class LivraisonSession(models.Model):
     sorties_sacs_total = fields.Float('Sacs sortis', compute='_compute_stats', store=True)
     sorties_kg_total = fields.Float('Kg sortis', compute='_compute_stats', store=True)
 
+    summary_ids = fields.One2many('pos.livraison.session.summary', 'session_id', string='Synthèses de clôture')
+    summary_id = fields.Many2one('pos.livraison.session.summary', string='Synthèse de clôture', compute='_compute_summary_id')
+
+    def init(self):
+        super().init()
+        _ensure_indexes(self.env.cr, self._table, {
+            # Session ouverte d'un livreur et fenêtre midi-midi
+            'pos_livraison_session_user_state_date_idx': "(user_id, state, date DESC)",
+        })
+
     def _get_default_session_name(self):
         return f"Livraison-{fields.Datetime.now().strftime('%Y-%m-%d')}"
 
@@ -395,21 +815,8 @@ class LivraisonSession(models.Model):
         return sess.id if sess else False
 
     @api.model
-    def _ensure_open_for_user(self, uid):
-        """Ensure an open session for user with noon-to-noon policy.
-        - A session spans from 12:00 to next day 12:00 in the user's timezone.
-        - Before noon: if a session exists (even closed) for the same user between yesterday 12:00 and today 12:00, reopen it; else create new.
-        - After noon: if a session exists since today's 12:00, reopen it; else create new.
-        """
-        uid = uid or self.env.uid
-        sid = self._get_open_for_user(uid)
-        if sid:
-            return sid
-
-        # Use the timezone of the target user (falls back to context tz or UTC)
-        user = self.env['res.users'].browse(uid)
-        tzname = user.tz or self.env.context.get('tz')
-
+    def _noon_window(self, tzname, now=None):
+        """Return the current noon-to-noon window [start, end) of timezone `tzname` as UTC strings."""
         # Helper: convert local dt (naive or aware) to UTC string in server format
         def to_utc_str(dt_local):
             try:
@@ -423,7 +830,7 @@ class LivraisonSession(models.Model):
                 return fields.Datetime.to_string(dt_local)
 
         # Compute now in user's tz (aware) and a tz-aware noon for today
-        now_utc = fields.Datetime.now()
+        now_utc = now or fields.Datetime.now()
         now_local = fields.Datetime.context_timestamp(self.with_context(tz=tzname), now_utc)
         today = now_local.date()
         try:
@@ -444,12 +851,31 @@ class LivraisonSession(models.Model):
         # Convert local window to UTC strings for searching
         start_utc = to_utc_str(start_local)
         end_utc = to_utc_str(end_local)
+        return start_utc, end_utc
+
+    @api.model
+    def _ensure_open_for_user(self, uid):
+        """Ensure an open session for user with noon-to-noon policy.
+        - A session spans from 12:00 to next day 12:00 in the user's timezone.
+        - Before noon: if a session exists (even closed) for the same user between yesterday 12:00 and today 12:00, reopen it; else create new.
+        - After noon: if a session exists since today's 12:00, reopen it; else create new.
+        """
+        uid = uid or self.env.uid
+        sid = self._get_open_for_user(uid)
+        if sid:
+            return sid
+
+        # Use the timezone of the target user (falls back to context tz or UTC)
+        user = self.env['res.users'].browse(uid)
+        tzname = user.tz or self.env.context.get('tz')
+        start_utc, end_utc = self._noon_window(tzname)
 
         domain = [('user_id', '=', uid), ('date', '>=', start_utc), ('date', '<', end_utc)]
         last = self.sudo().search(domain, order='date desc, id desc', limit=1)
         if last:
             if last.state != 'ouvert':
                 last.sudo().write({'state': 'ouvert', 'date_cloture': False})
+                last.sudo().summary_ids.unlink()
             return last.id
 
         sess = self.sudo().create({'user_id': uid, 'state': 'ouvert'})
@@ -467,14 +893,738 @@ class LivraisonSession(models.Model):
             s.sorties_sacs_total = sum(sorties.mapped('quantite_sacs')) if sorties else 0.0
             s.sorties_kg_total = sum(sorties.mapped('quantite_kg')) if sorties else 0.0
 
+    @api.depends('summary_ids')
+    def _compute_summary_id(self):
+        for s in self:
+            s.summary_id = s.summary_ids[:1]
+
     def action_open_session(self):
         self.ensure_one()
         self.state = 'ouvert'
         self.date_cloture = False
+        # La synthèse figée n'est plus valable une fois la session rouverte
+        self.summary_ids.sudo().unlink()
         return True
 
     def action_close_session(self):
         self.ensure_one()
         self.state = 'ferme'
         self.date_cloture = fields.Datetime.now()
+        self._build_summary()
+        self.env['pos.livraison.stock.checkpoint']._create_checkpoint(self.date_cloture, sessions=self)
+        self.env['pos.caisse.commande']._dispatch_release(self.user_id.ids)
+        return True
+
+    def _build_summary(self):
+        """Fige la synthèse de clôture des sessions: totaux par type de paiement, par
+        sortie de stock / livraison, par type de sortie, commandes touchées et
+        première/dernière livraison. Une seule requête groupée pour toutes les sessions.
+        """
+        Summary = self.env['pos.livraison.session.summary'].sudo()
+        if not self:
+            return Summary
+        self.env['pos.livraison.livraison'].flush(['session_id', 'type_paiement', 'is_sortie_stock', 'commande_id',
+                                                   'montant_livre', 'sacs_farine', 'date'])
+        self.env['pos.livraison.sortie.stock'].flush(['session_id', 'type', 'montant', 'quantite_sacs', 'date'])
+        self.env.cr.execute("""
+            SELECT session_id,
+                   CASE GROUPING(type_paiement, COALESCE(is_sortie_stock, false))
+                        WHEN 1 THEN 'type_paiement' WHEN 2 THEN 'sortie_stock' ELSE 'total' END,
+                   CASE GROUPING(type_paiement, COALESCE(is_sortie_stock, false))
+                        WHEN 1 THEN type_paiement
+                        WHEN 2 THEN CASE WHEN COALESCE(is_sortie_stock, false) THEN 'oui' ELSE 'non' END
+                   END,
+                   count(*), COALESCE(sum(montant_livre), 0), COALESCE(sum(sacs_farine), 0),
+                   count(DISTINCT commande_id), min(date), max(date)
+              FROM pos_livraison_livraison
+             WHERE session_id IN %(ids)s
+          GROUP BY GROUPING SETS ((session_id, type_paiement),
+                                  (session_id, COALESCE(is_sortie_stock, false)),
+                                  (session_id))
+         UNION ALL
+            SELECT session_id, 'type_sortie', type,
+                   count(*), COALESCE(sum(montant), 0), COALESCE(sum(quantite_sacs), 0),
+                   0, min(date), max(date)
+              FROM pos_livraison_sortie_stock
+             WHERE session_id IN %(ids)s
+          GROUP BY session_id, type
+        """, {'ids': tuple(self.ids)})
+        now = fields.Datetime.now()
+        vals_by_session = {sid: {
+            'session_id': sid,
+            'date_calcul': now,
+            'nombre_livraisons': 0,
+            'nombre_commandes': 0,
+            'montant_total': 0.0,
+            'sacs_total': 0.0,
+            'line_ids': [],
+        } for sid in self.ids}
+        for sid, dimension, cle, nombre, montant, sacs, commandes, first, last in self.env.cr.fetchall():
+            vals = vals_by_session[sid]
+            if dimension == 'total':
+                vals.update({
+                    'nombre_livraisons': nombre,
+                    'nombre_commandes': commandes,
+                    'montant_total': montant,
+                    'sacs_total': sacs,
+                    'date_premiere_livraison': first,
+                    'date_derniere_livraison': last,
+                })
+            else:
+                vals['line_ids'].append((0, 0, {
+                    'dimension': dimension,
+                    'cle': cle or '',
+                    'nombre': nombre,
+                    'montant': montant,
+                    'sacs': sacs,
+                }))
+        self.summary_ids.sudo().unlink()
+        return Summary.create(list(vals_by_session.values()))
+
+    @api.model
+    def _cron_rollover_sessions(self):
+        """Clôture en masse les sessions ouvertes dont la fenêtre midi-midi est échue
+        (un UPDATE par fuseau horaire), fige leurs synthèses et pré-crée la session de
+        la fenêtre courante pour les livreurs actifs.
+        """
+        Session = self.sudo()
+        open_sessions = Session.search([('state', '=', 'ouvert')])
+        if not open_sessions:
+            return True
+        open_sessions.flush(['state', 'date', 'user_id'])
+        by_tz = defaultdict(Session.browse)
+        for sess in open_sessions:
+            by_tz[sess.user_id.tz or False] |= sess
+        now = fields.Datetime.now()
+        closed = Session.browse()
+        to_open = []
+        for tzname, sessions in by_tz.items():
+            start_utc, end_utc = self._noon_window(tzname, now=now)
+            expired = sessions.filtered_domain([('date', '<', fields.Datetime.to_datetime(start_utc))])
+            if not expired:
+                continue
+            self.env.cr.execute("""
+                UPDATE pos_livraison_session
+                   SET state = 'ferme', date_cloture = %s, write_uid = %s, write_date = %s
+                 WHERE id IN %s
+            """, (now, self.env.uid, now, tuple(expired.ids)))
+            closed |= expired
+            # Livreurs actifs: au moins une livraison ou une sortie dans la session échue
+            active_users = expired.filtered(lambda s: s.total_livraisons or s.sorties_sacs_total).mapped('user_id')
+            if active_users:
+                already = Session.search([('user_id', 'in', active_users.ids),
+                                          ('date', '>=', start_utc), ('date', '<', end_utc)]).mapped('user_id')
+                to_open += [{'user_id': u.id, 'state': 'ouvert'} for u in active_users - already]
+        if closed:
+            closed.invalidate_cache(['state', 'date_cloture'])
+            closed._build_summary()
+            self.env['pos.livraison.stock.checkpoint']._create_checkpoint(now, sessions=closed)
+            self.env['pos.caisse.commande']._dispatch_release(closed.mapped('user_id').ids)
+        if to_open:
+            Session.create(to_open)
+        return True
+
+
+class LivraisonSessionSummary(models.Model):
+    _name = 'pos.livraison.session.summary'
+    _description = 'Synthèse de clôture de session'
+    _order = 'date_calcul desc'
+
+    session_id = fields.Many2one('pos.livraison.session', string='Session livraison', required=True, ondelete='cascade', index=True)
+    user_id = fields.Many2one('res.users', string='Livreur', related='session_id.user_id', store=True)
+    date_calcul = fields.Datetime('Calculée le', default=fields.Datetime.now, required=True)
+    nombre_livraisons = fields.Integer('Nombre de livraisons')
+    nombre_commandes = fields.Integer('Commandes touchées')
+    montant_total = fields.Float('Montant livré total')
+    sacs_total = fields.Float('Sacs livrés (total)')
+    date_premiere_livraison = fields.Datetime('Première livraison')
+    date_derniere_livraison = fields.Datetime('Dernière livraison')
+    line_ids = fields.One2many('pos.livraison.session.summary.line', 'summary_id', string='Détail')
+
+    _sql_constraints = [
+        ('session_uniq', 'unique(session_id)', 'Une seule synthèse par session.'),
+    ]
+
+
+class LivraisonSessionSummaryLine(models.Model):
+    _name = 'pos.livraison.session.summary.line'
+    _description = 'Ligne de synthèse de session'
+    _order = 'dimension, cle'
+
+    summary_id = fields.Many2one('pos.livraison.session.summary', string='Synthèse', required=True, ondelete='cascade', index=True)
+    dimension = fields.Selection([
+        ('type_paiement', 'Type de paiement'),
+        ('sortie_stock', 'Sortie de stock'),
+        ('type_sortie', 'Type de sortie'),
+    ], string='Regroupement', required=True)
+    cle = fields.Char('Valeur')
+    nombre = fields.Integer('Nombre')
+    montant = fields.Float('Montant')
+    sacs = fields.Float('Sacs')
+
+
+class LivraisonStockMove(models.Model):
+    """Journal de stock farine, en ajout seul: chaque livraison, sortie ou réception
+    ajoute un mouvement signé (sacs); les corrections sont de nouveaux mouvements."""
+    _name = 'pos.livraison.stock.move'
+    _description = 'Mouvement de stock farine'
+    _order = 'date desc, id desc'
+
+    name = fields.Char('Référence', readonly=True)
+    date = fields.Datetime('Date', default=fields.Datetime.now, required=True, index=True)
+    type = fields.Selection([
+        ('reception', 'Réception'),
+        ('livraison', 'Livraison'),
+        ('sortie', 'Sortie de stock'),
+        ('correction', 'Correction'),
+    ], string='Type de mouvement', required=True, default='reception', index=True)
+    quantite_sacs = fields.Float('Quantité (sacs)', required=True, help="Positive pour une entrée, négative pour une sortie.")
+    livraison_id = fields.Many2one('pos.livraison.livraison', string='Livraison', ondelete='set null', index=True, readonly=True)
+    sortie_id = fields.Many2one('pos.livraison.sortie.stock', string='Sortie de stock', ondelete='set null', index=True, readonly=True)
+    session_id = fields.Many2one('pos.livraison.session', string='Session livraison', ondelete='set null', index=True)
+    notes = fields.Text('Notes')
+
+    def init(self):
+        super().init()
+        # Ligne unique mise à jour par chaque écriture du journal (voir `_serialize_ledger`)
+        self.env.cr.execute("""
+            CREATE TABLE IF NOT EXISTS pos_livraison_stock_ledger_head (
+                id integer PRIMARY KEY, version bigint NOT NULL DEFAULT 0)
+        """)
+        self.env.cr.execute("INSERT INTO pos_livraison_stock_ledger_head (id) VALUES (1) ON CONFLICT DO NOTHING")
+
+    @api.model
+    def _serialize_ledger(self):
+        """Sérialise les créations de mouvements et de points de contrôle. Un point de contrôle
+        et un mouvement antidaté validés en parallèle ne se voient pas (instantané REPEATABLE
+        READ): le mouvement serait exclu de tous les soldes suivants. Les deux mettent à jour la
+        même ligne avant de lire: la seconde transaction attend la première puis, si celle-ci
+        est validée, échoue en erreur de sérialisation au lieu d'écrire un solde faux."""
+        self.env.cr.execute("UPDATE pos_livraison_stock_ledger_head SET version = version + 1 WHERE id = 1")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        for vals in vals_list:
+            if vals.get('type', 'reception') == 'reception' and (vals.get('quantite_sacs') or 0.0) <= 0:
+                raise exceptions.UserError('Une réception doit porter sur une quantité positive.')
+        if not vals_list:
+            return self.browse()
+        self._serialize_ledger()
+        moves = super().create(vals_list)
+        # Un mouvement antérieur à un point de contrôle le rend caduc
+        oldest = min(moves.mapped('date'))
+        self.env['pos.livraison.stock.checkpoint'].sudo().search([('date', '>=', oldest)]).unlink()
+        return moves
+
+    def write(self, vals):
+        raise exceptions.UserError('Le journal de stock est en ajout seul: enregistrez une correction.')
+
+    def unlink(self):
+        raise exceptions.UserError('Le journal de stock est en ajout seul: enregistrez une correction.')
+
+    @api.model
+    def _record_livraisons(self, livraisons, previous=None, reverse=False):
+        """Mouvements sortants des livraisons (hors sorties de stock, journalisées par la sortie).
+        `previous`: sacs déjà journalisés par livraison; `reverse`: annule ce qui a été journalisé.
+        """
+        now = fields.Datetime.now()
+        vals_list = []
+        for liv in livraisons.filtered(lambda l: not l.is_sortie_stock):
+            current = 0.0 if reverse else (liv.sacs_farine or 0.0)
+            before = liv.sacs_farine if reverse else (previous or {}).get(liv.id, 0.0)
+            delta = current - (before or 0.0)
+            if abs(delta) < 1e-6:
+                continue
+            vals_list.append({
+                'name': liv.name,
+                'date': liv.date if previous is None and not reverse else now,
+                'type': 'livraison' if previous is None and not reverse else 'correction',
+                'quantite_sacs': -delta,
+                'livraison_id': False if reverse else liv.id,
+                'session_id': liv.session_id.id,
+            })
+        return self.sudo().create(vals_list) if vals_list else self.browse()
+
+    @api.model
+    def _record_sorties(self, sorties, previous=None, reverse=False):
+        """Mouvements sortants des sorties de stock (mêmes conventions que `_record_livraisons`)."""
+        now = fields.Datetime.now()
+        vals_list = []
+        for sortie in sorties:
+            current = 0.0 if reverse else (sortie.quantite_sacs or 0.0)
+            before = sortie.quantite_sacs if reverse else (previous or {}).get(sortie.id, 0.0)
+            delta = current - (before or 0.0)
+            if abs(delta) < 1e-6:
+                continue
+            vals_list.append({
+                'name': sortie.name,
+                'date': sortie.date if previous is None and not reverse else now,
+                'type': 'sortie' if previous is None and not reverse else 'correction',
+                'quantite_sacs': -delta,
+                'sortie_id': False if reverse else sortie.id,
+                'session_id': sortie.session_id.id,
+            })
+        return self.sudo().create(vals_list) if vals_list else self.browse()
+
+    @api.model
+    def _get_balance(self, at=None):
+        """Stock (sacs) à la date `at` (maintenant par défaut): dernier point de contrôle
+        antérieur + somme des mouvements postérieurs.
+        Retourne (solde, point de contrôle utilisé)."""
+        at = at or fields.Datetime.now()
+        checkpoint = self.env['pos.livraison.stock.checkpoint'].sudo().search(
+            [('date', '<=', at)], order='date desc, id desc', limit=1)
+        domain = [('date', '<=', at)]
+        solde = 0.0
+        if checkpoint:
+            domain.append(('date', '>', checkpoint.date))
+            solde = checkpoint.solde_sacs
+        res = self.sudo().read_group(domain, ['quantite_sacs:sum'], [])
+        solde += (res and res[0]['quantite_sacs']) or 0.0
+        return solde, checkpoint
+
+    @api.model
+    def _backfill_from_history(self):
+        """Journalise en une passe les livraisons et sorties existantes sans mouvement."""
+        self.flush()
+        self.env['pos.livraison.livraison'].flush(['name', 'date', 'sacs_farine', 'session_id', 'is_sortie_stock'])
+        self.env['pos.livraison.sortie.stock'].flush(['name', 'date', 'quantite_sacs', 'session_id'])
+        self.env.cr.execute("""
+            INSERT INTO pos_livraison_stock_move
+                   (name, date, type, quantite_sacs, livraison_id, session_id,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT l.name, l.date, 'livraison', -COALESCE(l.sacs_farine, 0), l.id, l.session_id,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM pos_livraison_livraison l
+             WHERE NOT COALESCE(l.is_sortie_stock, false)
+               AND NOT EXISTS (SELECT 1 FROM pos_livraison_stock_move m WHERE m.livraison_id = l.id)
+        """, {'uid': self.env.uid})
+        self.env.cr.execute("""
+            INSERT INTO pos_livraison_stock_move
+                   (name, date, type, quantite_sacs, sortie_id, session_id,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT s.name, s.date, 'sortie', -COALESCE(s.quantite_sacs, 0), s.id, s.session_id,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM pos_livraison_sortie_stock s
+             WHERE NOT EXISTS (SELECT 1 FROM pos_livraison_stock_move m WHERE m.sortie_id = s.id)
+        """, {'uid': self.env.uid})
+        self.invalidate_cache()
+        checkpoints = self.env['pos.livraison.stock.checkpoint'].sudo()
+        checkpoints.search([]).unlink()
+        return checkpoints._create_checkpoint()
+
+
+class LivraisonStockCheckpoint(models.Model):
+    _name = 'pos.livraison.stock.checkpoint'
+    _description = 'Point de contrôle du stock farine'
+    _order = 'date desc, id desc'
+
+    date = fields.Datetime('Date', required=True, index=True)
+    solde_sacs = fields.Float('Solde (sacs)')
+    type = fields.Selection([('jour', 'Journalier'), ('session', 'Clôture de session')],
+                            string='Type', required=True, default='jour')
+    session_id = fields.Many2one('pos.livraison.session', string='Session livraison', ondelete='set null', index=True)
+
+    @api.model
+    def _create_checkpoint(self, at=None, sessions=None):
+        """Fige le solde à la date `at`: un point journalier, ou un point par session clôturée."""
+        at = at or fields.Datetime.now()
+        Move = self.env['pos.livraison.stock.move']
+        Move._serialize_ledger()
+        solde, _checkpoint = Move._get_balance(at)
+        if sessions:
+            vals_list = [{'date': at, 'solde_sacs': solde, 'type': 'session', 'session_id': s.id} for s in sessions]
+        else:
+            vals_list = [{'date': at, 'solde_sacs': solde, 'type': 'jour'}]
+        return self.sudo().create(vals_list)
+
+    @api.model
+    def _cron_daily_checkpoint(self):
+        """Point de contrôle quotidien à minuit (UTC)."""
+        at = fields.Datetime.to_datetime(fields.Date.today())
+        if not self.sudo().search_count([('type', '=', 'jour'), ('date', '=', at)]):
+            self._create_checkpoint(at)
+        return True
+
+
+class LivraisonJob(models.Model):
+    """File de tâches différées (effets de bord non critiques des livraisons).
+    Une tâche appelle `model_name.browse(res_ids).<method_name>(**kwargs)`; seules les
+    méthodes préfixées `_job_` sont autorisées. Les tâches en attente de même méthode et
+    mêmes arguments sont regroupées en un seul appel par le cron de traitement.
+    """
+    _name = 'pos.livraison.job'
+    _description = 'Tâche différée livraison'
+    _order = 'priority, id'
+
+    MAX_ATTEMPTS = 3
+
+    model_name = fields.Char('Modèle', required=True)
+    method_name = fields.Char('Méthode', required=True)
+    res_ids = fields.Text('Enregistrements (JSON)', required=True, default='[]')
+    kwargs = fields.Text('Arguments (JSON)', required=True, default='{}')
+    priority = fields.Integer('Priorité', default=10)
+    user_id = fields.Many2one('res.users', string='Utilisateur', default=lambda self: self.env.user, required=True)
+    state = fields.Selection([
+        ('pending', 'En attente'),
+        ('done', 'Terminée'),
+        ('failed', 'En échec'),
+    ], default='pending', string='État', required=True, index=True)
+    attempts = fields.Integer('Tentatives', default=0)
+    error = fields.Text('Erreur')
+    date_done = fields.Datetime('Terminée le')
+
+    @api.model
+    def _enqueue(self, records, method, priority=10, **kwargs):
+        """Planifie `records.<method>(**kwargs)`. Exécution immédiate si le paramètre
+        `pos_livraison.jobs_async` vaut '0' ou avec le contexte `pos_livraison_jobs_sync`."""
+        if not method.startswith('_job_'):
+            raise ValueError(f"Méthode de tâche non autorisée: {method}")
+        if not records:
+            return self.browse()
+        sync = self.env.context.get('pos_livraison_jobs_sync') or \
+            self.env['ir.config_parameter'].sudo().get_param('pos_livraison.jobs_async', '1') == '0'
+        if sync:
+            getattr(records, method)(**kwargs)
+            return self.browse()
+        job = self.sudo().create({
+            'model_name': records._name,
+            'method_name': method,
+            'res_ids': json.dumps(records.ids),
+            'kwargs': json.dumps(kwargs, sort_keys=True),
+            'priority': priority,
+            'user_id': self.env.uid,
+        })
+        # Un seul déclenchement du cron par transaction
+        data = self.env.cr.precommit.data
+        if not data.get('pos_livraison.job_triggered'):
+            data['pos_livraison.job_triggered'] = True
+            cron = self.env.ref('pos_livraison.ir_cron_pos_livraison_jobs', raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger()
+        return job
+
+    @api.model
+    def _cron_process_jobs(self, limit=500):
+        """Traite les tâches en attente (verrouillage SKIP LOCKED: plusieurs workers possibles)."""
+        self.env.cr.execute("""
+            SELECT id FROM pos_livraison_job
+             WHERE state = 'pending'
+          ORDER BY priority, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, (limit,))
+        jobs = self.sudo().browse([row[0] for row in self.env.cr.fetchall()])
+        groups = defaultdict(lambda: self.sudo().browse())
+        for job in jobs:
+            groups[(job.model_name, job.method_name, job.kwargs, job.user_id.id)] |= job
+        now = fields.Datetime.now()
+        for (model_name, method_name, kwargs, uid), group in groups.items():
+            ids = sorted({rid for job in group for rid in json.loads(job.res_ids)})
+            self.env['base'].flush()
+            try:
+                with self.env.cr.savepoint():
+                    records = self.env[model_name].with_user(uid).browse(ids).exists()
+                    if method_name.startswith('_job_') and records:
+                        getattr(records, method_name)(**json.loads(kwargs))
+                group.write({'state': 'done', 'date_done': now, 'error': False})
+            except Exception as e:
+                _logger.exception("Échec de la tâche %s.%s sur %s", model_name, method_name, ids)
+                self.env.cache.invalidate()
+                for job in group:
+                    attempts = job.attempts + 1
+                    job.write({
+                        'attempts': attempts,
+                        'state': 'failed' if attempts >= self.MAX_ATTEMPTS else 'pending',
+                        'error': str(e),
+                    })
+        # Purge des tâches terminées depuis plus d'une semaine
+        self.sudo().search([('state', '=', 'done'), ('date_done', '<', now - timedelta(days=7))]).unlink()
+        if len(jobs) >= limit:
+            self.env.ref('pos_livraison.ir_cron_pos_livraison_jobs').sudo()._trigger()
+        return True
+
+
+class LivraisonStatDaily(models.Model):
+    """Série journalière des livraisons clients (hors sorties de stock), par jour local:
+    total, par type de paiement et par livreur. Alimentée en SQL par le cron de prévision."""
+    _name = 'pos.livraison.stat.daily'
+    _description = 'Statistique journalière de livraison'
+    _order = 'date desc, dimension, cle'
+
+    date = fields.Date('Jour', required=True, index=True)
+    dimension = fields.Selection([
+        ('total', 'Total'),
+        ('type_paiement', 'Type de paiement'),
+        ('livreur', 'Livreur'),
+    ], string='Regroupement', required=True)
+    cle = fields.Char('Valeur')
+    livreur_id = fields.Many2one('res.users', string='Livreur')
+    nombre = fields.Integer('Nombre')
+    montant = fields.Float('Montant')
+    sacs = fields.Float('Sacs')
+
+    _sql_constraints = [
+        ('date_dimension_cle_uniq', 'unique(date, dimension, cle)', 'Une seule statistique par jour et par valeur.'),
+    ]
+
+    @api.model
+    def _stat_tz(self):
+        return self.env.company.partner_id.tz or self.env.user.tz or 'UTC'
+
+    @api.model
+    def _local_today(self):
+        return fields.Datetime.context_timestamp(self.with_context(tz=self._stat_tz()), fields.Datetime.now()).date()
+
+    @api.model
+    def _update_daily_stats(self, date_from=None):
+        """Recalcule les jours depuis `date_from` (par défaut le dernier jour agrégé, ou le
+        premier jour de livraison) jusqu'à hier inclus: une requête groupée pour tous les jours."""
+        tz = self._stat_tz()
+        today = self._local_today()
+        cr = self.env.cr
+        if date_from is None:
+            cr.execute("SELECT max(date) FROM pos_livraison_stat_daily")
+            date_from = cr.fetchone()[0]
+        if date_from is None:
+            cr.execute("SELECT min((date AT TIME ZONE 'UTC' AT TIME ZONE %s)::date) FROM pos_livraison_livraison", (tz,))
+            date_from = cr.fetchone()[0]
+        if not date_from or date_from >= today:
+            return 0
+        self.env['pos.livraison.livraison'].flush(['date', 'type_paiement', 'livreur_id', 'is_sortie_stock',
+                                                   'montant_livre', 'sacs_farine'])
+        params = {'from': date_from, 'to': today, 'tz': tz, 'uid': self.env.uid}
+        cr.execute("DELETE FROM pos_livraison_stat_daily WHERE date >= %(from)s AND date < %(to)s", params)
+        cr.execute("""
+            INSERT INTO pos_livraison_stat_daily
+                   (date, dimension, cle, livreur_id, nombre, montant, sacs,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT day,
+                   CASE GROUPING(type_paiement, livreur_id)
+                        WHEN 1 THEN 'type_paiement' WHEN 2 THEN 'livreur' ELSE 'total' END,
+                   CASE GROUPING(type_paiement, livreur_id)
+                        WHEN 1 THEN COALESCE(type_paiement, '') WHEN 2 THEN COALESCE(livreur_id::text, '') ELSE '' END,
+                   CASE GROUPING(type_paiement, livreur_id) WHEN 2 THEN livreur_id END,
+                   count(*), COALESCE(sum(montant_livre), 0), COALESCE(sum(sacs_farine), 0),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM (SELECT (date AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date AS day,
+                           type_paiement, livreur_id, montant_livre, sacs_farine
+                      FROM pos_livraison_livraison
+                     WHERE NOT COALESCE(is_sortie_stock, false)
+                       AND date >= (%(from)s::timestamp AT TIME ZONE %(tz)s) AT TIME ZONE 'UTC'
+                       AND date < (%(to)s::timestamp AT TIME ZONE %(tz)s) AT TIME ZONE 'UTC') l
+          GROUP BY GROUPING SETS ((day, type_paiement), (day, livreur_id), (day))
+        """, params)
+        self.invalidate_cache()
+        return cr.rowcount
+
+
+class LivraisonForecast(models.Model):
+    """Prévisions journalières (sacs, montant, nombre de livraisons, livreurs nécessaires)
+    calculées chaque nuit à partir de `pos.livraison.stat.daily`."""
+    _name = 'pos.livraison.forecast'
+    _description = 'Prévision de livraison'
+    _order = 'date, dimension, cle'
+
+    HORIZON = 7
+    HISTORY_DAYS = 56
+
+    date = fields.Date('Jour prévu', required=True, index=True)
+    dimension = fields.Selection([
+        ('total', 'Total'),
+        ('type_paiement', 'Type de paiement'),
+        ('livreur', 'Livreur'),
+    ], string='Regroupement', required=True)
+    cle = fields.Char('Valeur')
+    livreur_id = fields.Many2one('res.users', string='Livreur')
+    nombre = fields.Float('Livraisons prévues')
+    montant = fields.Float('Montant prévu')
+    sacs = fields.Float('Sacs prévus')
+    livreurs_requis = fields.Integer('Livreurs nécessaires')
+    date_calcul = fields.Datetime('Calculée le', default=fields.Datetime.now, required=True)
+
+    _sql_constraints = [
+        ('date_dimension_cle_uniq', 'unique(date, dimension, cle)', 'Une seule prévision par jour et par valeur.'),
+    ]
+
+    @api.model
+    def _compute_forecasts(self, horizon=None, history_days=None):
+        """Ajuste le modèle saisonnier sur les `history_days` derniers jours de toutes les
+        séries à la fois et remplace les prévisions à partir d'aujourd'hui."""
+        if np is None:
+            _logger.warning("numpy indisponible: prévisions de livraison non calculées")
+            return self.browse()
+        horizon = horizon or self.HORIZON
+        history_days = history_days or self.HISTORY_DAYS
+        today = self.env['pos.livraison.stat.daily']._local_today()
+        start = today - timedelta(days=history_days)
+        self.env['pos.livraison.stat.daily'].flush()
+        self.env.cr.execute("""
+            SELECT date, dimension, cle, livreur_id, nombre, montant, sacs
+              FROM pos_livraison_stat_daily
+             WHERE date >= %s AND date < %s
+        """, (start, today))
+        rows = self.env.cr.fetchall()
+        series = {}
+        for _day, dimension, cle, livreur_id, *_values in rows:
+            series.setdefault((dimension, cle or ''), livreur_id)
+        keys = list(series)
+        index = {key: i for i, key in enumerate(keys)}
+        # séries x (nombre, montant, sacs) x jours
+        history = np.zeros((len(keys), 3, history_days))
+        driver_days = 0
+        driver_livraisons = 0
+        for day, dimension, cle, _livreur_id, nombre, montant, sacs in rows:
+            history[index[(dimension, cle or '')], :, (day - start).days] = (nombre, montant, sacs)
+            if dimension == 'livreur' and nombre:
+                driver_days += 1
+                driver_livraisons += nombre
+        predicted = seasonal_forecast(history.reshape(-1, history_days), horizon).reshape(len(keys), 3, horizon)
+        # Productivité moyenne d'un livreur actif sur une journée
+        productivite = driver_livraisons / driver_days if driver_days else 0.0
+
+        now = fields.Datetime.now()
+        vals_list = []
+        for (dimension, cle), i in index.items():
+            for h in range(horizon):
+                nombre, montant, sacs = predicted[i, :, h]
+                vals_list.append({
+                    'date': today + timedelta(days=h),
+                    'dimension': dimension,
+                    'cle': cle,
+                    'livreur_id': series[(dimension, cle)],
+                    'nombre': float(nombre),
+                    'montant': float(montant),
+                    'sacs': float(sacs),
+                    'livreurs_requis': math.ceil(nombre / productivite) if dimension == 'total' and productivite else 0,
+                    'date_calcul': now,
+                })
+        self.sudo().search([('date', '>=', today)]).unlink()
+        return self.sudo().create(vals_list)
+
+    @api.model
+    def _cron_forecast(self):
+        """Agrège les jours écoulés depuis le dernier passage puis recalcule les prévisions."""
+        self.env['pos.livraison.stat.daily'].sudo()._update_daily_stats()
+        self._compute_forecasts()
+        return True
+
+
+class LivraisonStateEvent(models.Model):
+    """Historique des changements d'état de livraison des commandes, en ajout seul.
+    Écrit en une requête par lot depuis `PosCommande.create` / `PosCommande.write`."""
+    _name = 'pos.livraison.state.event'
+    _description = "Changement d'état de livraison"
+    _order = 'date desc, id desc'
+
+    commande_id = fields.Many2one('pos.caisse.commande', string='Commande', required=True, ondelete='cascade')
+    etat_avant = fields.Selection(lambda self: self.env['pos.caisse.commande']._fields['etat_livraison'].selection,
+                                  string='État précédent')
+    etat_apres = fields.Selection(lambda self: self.env['pos.caisse.commande']._fields['etat_livraison'].selection,
+                                  string='Nouvel état', required=True)
+    date = fields.Datetime('Date', required=True, index=True)
+    user_id = fields.Many2one('res.users', string='Utilisateur')
+    progression = fields.Float('Progression (%)')
+
+    def init(self):
+        super().init()
+        _ensure_indexes(self.env.cr, self._table, {
+            # Historique d'une commande et événement précédent (temps de séjour)
+            'pos_livraison_state_event_commande_date_idx': "(commande_id, date, id)",
+        })
+
+    @api.model
+    def _record_transitions(self, commandes, old_states=None):
+        """Ajoute un événement par commande de `commandes` (état courant), `old_states`
+        donnant l'état précédent par id (aucun pour une création)."""
+        if not commandes:
+            return
+        old_states = old_states or {}
+        # Horodatage à la microseconde: plusieurs transitions peuvent se suivre dans la même seconde
+        now = datetime.now()
+        uid = self.env.uid
+        rows = [(c.id, old_states.get(c.id) or None, c.etat_livraison, now, uid, c.progression or 0.0, uid, now, uid, now)
+                for c in commandes]
+        self.env.cr.execute("""
+            INSERT INTO pos_livraison_state_event
+                   (commande_id, etat_avant, etat_apres, date, user_id, progression,
+                    create_uid, create_date, write_uid, write_date)
+            VALUES %s
+        """ % ', '.join(['%s'] * len(rows)), rows)
+
+    def write(self, vals):
+        raise exceptions.UserError("L'historique des états est en ajout seul.")
+
+    def unlink(self):
+        raise exceptions.UserError("L'historique des états est en ajout seul.")
+
+
+class LivraisonStateDwell(models.Model):
+    """Temps de séjour dans chaque état de livraison, par jour de sortie de l'état.
+    Agrégé chaque nuit depuis `pos.livraison.state.event`; une moyenne sur une période est
+    `sum(duree_totale) / sum(nombre)`."""
+    _name = 'pos.livraison.state.dwell'
+    _description = 'Temps de séjour par état de livraison'
+    _order = 'date desc, etat'
+
+    date = fields.Date('Jour', required=True, index=True)
+    etat = fields.Selection(lambda self: self.env['pos.caisse.commande']._fields['etat_livraison'].selection,
+                            string='État', required=True)
+    nombre = fields.Integer('Sorties de l\'état')
+    duree_totale = fields.Float('Durée totale (h)')
+    duree_moyenne = fields.Float('Durée moyenne (h)')
+    duree_p50 = fields.Float('Médiane (h)')
+    duree_p90 = fields.Float('90e centile (h)')
+    duree_max = fields.Float('Durée max (h)')
+
+    _sql_constraints = [
+        ('date_etat_uniq', 'unique(date, etat)', 'Un seul agrégat par jour et par état.'),
+    ]
+
+    @api.model
+    def _update_dwell(self, date_from=None):
+        """Recalcule les jours depuis `date_from` (par défaut le dernier jour agrégé, ou le
+        premier événement) jusqu'à hier inclus. Le séjour d'un événement est l'écart avec
+        l'événement précédent de la même commande."""
+        Stat = self.env['pos.livraison.stat.daily']
+        tz = Stat._stat_tz()
+        today = Stat._local_today()
+        cr = self.env.cr
+        if date_from is None:
+            cr.execute("SELECT max(date) FROM pos_livraison_state_dwell")
+            date_from = cr.fetchone()[0]
+        if date_from is None:
+            cr.execute("SELECT min((date AT TIME ZONE 'UTC' AT TIME ZONE %s)::date) FROM pos_livraison_state_event", (tz,))
+            date_from = cr.fetchone()[0]
+        if not date_from or date_from >= today:
+            return 0
+        params = {'from': date_from, 'to': today, 'tz': tz, 'uid': self.env.uid}
+        cr.execute("DELETE FROM pos_livraison_state_dwell WHERE date >= %(from)s AND date < %(to)s", params)
+        cr.execute("""
+            INSERT INTO pos_livraison_state_dwell
+                   (date, etat, nombre, duree_totale, duree_moyenne, duree_p50, duree_p90, duree_max,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT day, etat_avant, count(*), sum(h), avg(h),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY h),
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY h),
+                   max(h),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM (SELECT (e.date AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date AS day, e.etat_avant,
+                           EXTRACT(EPOCH FROM e.date - p.date) / 3600.0 AS h
+                      FROM pos_livraison_state_event e
+                      JOIN LATERAL (SELECT date FROM pos_livraison_state_event
+                                     WHERE commande_id = e.commande_id AND (date, id) < (e.date, e.id)
+                                  ORDER BY date DESC, id DESC
+                                     LIMIT 1) p ON true
+                     WHERE e.etat_avant IS NOT NULL
+                       AND e.date >= (%(from)s::timestamp AT TIME ZONE %(tz)s) AT TIME ZONE 'UTC'
+                       AND e.date < (%(to)s::timestamp AT TIME ZONE %(tz)s) AT TIME ZONE 'UTC') d
+          GROUP BY day, etat_avant
+        """, params)
+        self.invalidate_cache()
+        return cr.rowcount
+
+    @api.model
+    def _cron_update_dwell(self):
+        self.sudo()._update_dwell()
         return True
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Débit d'allocation concurrente des références (LP-/SOR-) selon le nombre de workers.
+
+Compare, avec de vraies transactions PostgreSQL concurrentes (une connexion par worker):
+- nogap: compteur sur une ligne (UPDATE ... RETURNING), comme une séquence Odoo « sans trou »:
+  la ligne reste verrouillée jusqu'au commit, les créations sont sérialisées;
+- native: séquence PostgreSQL (nextval), comme l'implémentation « standard » utilisée par le module:
+  aucun verrou entre transactions.
+Chaque transaction réserve `--batch` références puis simule le reste de la création
+(`--hold-ms`) avant de valider. Les objets de test sont créés puis supprimés dans la base ciblée.
+
+Exemple:
+    python3 scripts/bench_sequences.py --db livraison --workers 1,2,4,8,16 --duration 5
+"""
+import argparse
+import sys
+import threading
+import time
+
+import psycopg2
+
+COUNTER_TABLE = 'pos_livraison_bench_counter'
+NATIVE_SEQUENCE = 'pos_livraison_bench_seq'
+
+QUERIES = {
+    'nogap': f"WITH c AS (UPDATE {COUNTER_TABLE} SET number_next = number_next + %(batch)s WHERE id = 1 "
+             f"RETURNING number_next) SELECT generate_series(number_next - %(batch)s, number_next - 1) FROM c",
+    'native': f"SELECT nextval('{NATIVE_SEQUENCE}') FROM generate_series(1, %(batch)s)",
+}
+
+
+def _connect(args):
+    return psycopg2.connect(dbname=args.db, host=args.host, port=args.port, user=args.user, password=args.password)
+
+
+def setup(args):
+    with _connect(args) as conn, conn.cursor() as cr:
+        cr.execute(f"DROP TABLE IF EXISTS {COUNTER_TABLE}")
+        cr.execute(f"DROP SEQUENCE IF EXISTS {NATIVE_SEQUENCE}")
+        cr.execute(f"CREATE TABLE {COUNTER_TABLE} (id integer PRIMARY KEY, number_next integer NOT NULL)")
+        cr.execute(f"INSERT INTO {COUNTER_TABLE} VALUES (1, 1)")
+        cr.execute(f"CREATE SEQUENCE {NATIVE_SEQUENCE}")
+
+
+def teardown(args):
+    with _connect(args) as conn, conn.cursor() as cr:
+        cr.execute(f"DROP TABLE IF EXISTS {COUNTER_TABLE}")
+        cr.execute(f"DROP SEQUENCE IF EXISTS {NATIVE_SEQUENCE}")
+
+
+def worker(args, mode, deadline, numbers, lock):
+    allocated = []
+    conn = _connect(args)
+    try:
+        with conn.cursor() as cr:
+            while time.monotonic() < deadline:
+                cr.execute(QUERIES[mode], {'batch': args.batch})
+                batch = [row[0] for row in cr.fetchall()]
+                if args.hold_ms:
+                    time.sleep(args.hold_ms / 1000.0)
+                conn.commit()
+                allocated += batch
+    finally:
+        conn.close()
+    with lock:
+        numbers += allocated
+
+
+def run(args, mode, workers):
+    numbers = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=worker, args=(args, mode, deadline, numbers, lock)) for _i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    return len(numbers) / elapsed, len(numbers) - len(set(numbers))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--host')
+    parser.add_argument('--port')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--workers', default='1,2,4,8,16', help="nombres de workers testés")
+    parser.add_argument('--modes', default='nogap,native')
+    parser.add_argument('--duration', type=float, default=5.0, help="durée de chaque mesure (s)")
+    parser.add_argument('--batch', type=int, default=1, help="références réservées par transaction")
+    parser.add_argument('--hold-ms', type=float, default=5.0, help="durée simulée du reste de la création (ms)")
+    args = parser.parse_args(argv)
+
+    workers_list = [int(w) for w in args.workers.split(',')]
+    modes = [m.strip() for m in args.modes.split(',')]
+    setup(args)
+    duplicates = 0
+    try:
+        print(f"{'mode':<8} {'workers':>7} {'réf/s':>10} {'x1 worker':>10}")
+        for mode in modes:
+            baseline = None
+            for workers in workers_list:
+                throughput, dup = run(args, mode, workers)
+                duplicates += dup
+                baseline = baseline or throughput
+                print(f"{mode:<8} {workers:>7} {throughput:>10.0f} {throughput / baseline:>10.2f}")
+    finally:
+        teardown(args)
+    if duplicates:
+        print(f"{duplicates} référence(s) allouée(s) en double", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Test de charge de l'API livraison avec une flotte de livreurs simulés.
+
+Chaque livreur simulé est un thread avec sa propre session HTTP: il ouvre sa session de
+livraison, interroge /api/livraison/queue, livre des sacs sur une commande de la file via
+/api/livraison/nouvelle_livraison et enregistre de temps en temps une sortie de stock.
+En fin de test, le script affiche le débit, les percentiles de latence par route, les taux
+d'erreurs et de conflits de sérialisation, puis vérifie les invariants (aucune commande
+livrée au-delà de `montant_cible`, `montant_livre` égal à la somme des livraisons).
+
+Les livreurs (`loadtest_driver_NNN`, mot de passe = login) et les commandes du test sont créés
+par le compte administrateur. Uniquement la bibliothèque standard: aucune dépendance à installer.
+
+Exemple:
+    python3 scripts/load_test.py --url http://localhost:8069 --db livraison \\
+        --admin-password admin --drivers 50 --orders 2000 --duration 120
+"""
+import argparse
+import http.cookiejar
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+GROUPS = ('base.group_user', 'pos_livraison.group_pos_livraison_user', 'pos_caisse.group_pos_caisse_user')
+SERIALIZATION_MARKERS = ('could not serialize', 'concurrent update', 'deadlock detected', 'lock timeout')
+REJECTION_MARKERS = ('dépasse', 'Commande non trouvée')
+
+
+class RpcError(Exception):
+    pass
+
+
+class Client:
+    """Session HTTP JSON-RPC vers Odoo (cookie de session propre à chaque client)."""
+
+    def __init__(self, url, db, timeout=60):
+        self.url = url.rstrip('/')
+        self.db = db
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def call(self, route, params=None, method='POST'):
+        body = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'params': params or {}}).encode()
+        req = urllib.request.Request(self.url + route, data=body, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        with self.opener.open(req, timeout=self.timeout) as response:
+            payload = json.loads(response.read().decode())
+        if payload.get('error'):
+            error = payload['error']
+            raise RpcError((error.get('data') or {}).get('message') or error.get('message') or str(error))
+        return payload.get('result')
+
+    def authenticate(self, login, password):
+        result = self.call('/web/session/authenticate', {'db': self.db, 'login': login, 'password': password})
+        if not result or not result.get('uid'):
+            raise RpcError(f"authentification refusée pour {login}")
+        return result['uid']
+
+    def call_kw(self, model, method, args=(), **kwargs):
+        return self.call(f'/web/dataset/call_kw/{model}/{method}', {
+            'model': model, 'method': method, 'args': list(args), 'kwargs': kwargs,
+        })
+
+
+class Metrics:
+    """Latences et issues par route, partagées entre les threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, seconds, outcome):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.outcomes[route][outcome] += 1
+
+    def report(self, elapsed):
+        lines = []
+        total = sum(len(v) for v in self.latencies.values())
+        lines.append(f"{total} requêtes en {elapsed:.1f} s, {total / elapsed if elapsed else 0:.1f} req/s")
+        header = f"{'route':<40} {'n':>6} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}  issues"
+        lines.append(header)
+        lines.append('-' * len(header))
+        summary = {'requests': total, 'seconds': elapsed, 'routes': {}}
+        for route in sorted(self.latencies):
+            values = sorted(self.latencies[route])
+            stats = {p: _percentile(values, p) * 1000 for p in (50, 90, 95, 99, 100)}
+            outcomes = dict(self.outcomes[route])
+            summary['routes'][route] = {'count': len(values), 'ms': stats, 'outcomes': outcomes}
+            lines.append(f"{route:<40} {len(values):>6} " + ' '.join(f"{stats[p]:>8.1f}" for p in (50, 90, 95, 99, 100))
+                         + '  ' + ', '.join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+        errors = sum(o.get('error', 0) for o in self.outcomes.values())
+        conflicts = sum(o.get('serialization', 0) for o in self.outcomes.values())
+        summary.update(error_rate=errors / total if total else 0.0,
+                       serialization_rate=conflicts / total if total else 0.0)
+        lines.append(f"taux d'erreur: {summary['error_rate']:.2%}, conflits de sérialisation: "
+                     f"{summary['serialization_rate']:.2%}")
+        return '\n'.join(lines), summary
+
+
+def _percentile(values, percent):
+    """Percentile au rang le plus proche d'une liste triée."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(percent / 100.0 * len(values))) - 1))
+    return values[rank]
+
+
+def _classify(result=None, error=None):
+    message = str(error) if error else ''
+    if result is not None and error is None:
+        if result.get('status') == 'success':
+            return 'success'
+        message = result.get('message') or ''
+    if any(marker in message for marker in SERIALIZATION_MARKERS):
+        return 'serialization'
+    if any(marker in message for marker in REJECTION_MARKERS):
+        return 'rejected'
+    return 'error'
+
+
+def _timed_call(client, metrics, route, params=None, method='POST'):
+    start = time.perf_counter()
+    result = error = None
+    try:
+        result = client.call(route, params, method=method)
+    except (RpcError, urllib.error.URLError, OSError, ValueError) as e:
+        error = e
+    metrics.record(route, time.perf_counter() - start, _classify(result, error))
+    return result if error is None else None
+
+
+# ==== Préparation des données (compte administrateur) ====
+def _group_ids(admin):
+    ids = []
+    for xmlid in GROUPS:
+        module, name = xmlid.split('.')
+        rows = admin.call_kw('ir.model.data', 'search_read', [[('module', '=', module), ('name', '=', name)]],
+                             fields=['res_id'], limit=1)
+        if not rows:
+            raise RpcError(f"groupe {xmlid} introuvable: module non installé ?")
+        ids.append(rows[0]['res_id'])
+    return ids
+
+
+def setup_drivers(admin, count, tz):
+    logins = [f'loadtest_driver_{i:03d}' for i in range(count)]
+    existing = {u['login'] for u in admin.call_kw('res.users', 'search_read', [[('login', 'in', logins)]],
+                                                  fields=['login'])}
+    missing = [login for login in logins if login not in existing]
+    if missing:
+        groups = _group_ids(admin)
+        admin.call_kw('res.users', 'create', [[{
+            'name': f'Livreur {login[-3:]} (test de charge)', 'login': login, 'password': login,
+            'tz': tz, 'groups_id': [(6, 0, groups)],
+        } for login in missing]])
+    return logins
+
+
+def setup_orders(admin, count, run_id, prix_sac, max_sacs, chunk=200):
+    ids = []
+    for offset in range(0, count, chunk):
+        vals = [{
+            'client_name': f'Client charge {i}',
+            'client_card': f'LOAD{run_id}-{i:05d}',
+            'total': prix_sac * random.randint(1, max_sacs),
+            'priority_livraison': random.choice('0000012'),
+        } for i in range(offset, min(count, offset + chunk))]
+        ids += admin.call_kw('pos.caisse.commande', 'create', [vals])
+    return ids
+
+
+# ==== Livreur simulé ====
+def run_driver(args, login, deadline, metrics, prix_sac):
+    client = Client(args.url, args.db, timeout=args.timeout)
+    try:
+        client.authenticate(login, login)
+    except (RpcError, urllib.error.URLError, OSError) as e:
+        metrics.record('/web/session/authenticate', 0.0, 'error')
+        print(f"{login}: {e}", file=sys.stderr)
+        return
+    rng = random.Random(f'{args.seed}-{login}')
+    _timed_call(client, metrics, '/api/livraison/session/open')
+    while time.monotonic() < deadline:
+        if rng.random() < args.stock_ratio:
+            _timed_call(client, metrics, '/api/livraison/sortie_stock', {
+                'motif': 'Test de charge', 'quantite_sacs': rng.randint(1, 3), 'type': rng.choice(['perte', 'don']),
+            })
+        else:
+            queue = _timed_call(client, metrics, '/api/livraison/queue', method='GET')
+            commandes = (queue or {}).get('data') or []
+            if commandes:
+                # Plusieurs livreurs visent les mêmes commandes de tête: contention réaliste
+                commande = rng.choice(commandes[:args.top_k])
+                _timed_call(client, metrics, '/api/livraison/nouvelle_livraison', {
+                    'commande_id': commande['id'],
+                    'montant_livre': prix_sac * rng.randint(1, 2),
+                    'type_paiement': rng.choice(['cash', 'cash', 'bp']),
+                })
+        if args.think_time:
+            time.sleep(rng.uniform(0, 2 * args.think_time))
+    if args.close_sessions:
+        _timed_call(client, metrics, '/api/livraison/session/close')
+
+
+# ==== Invariants ====
+def check_invariants(admin, run_id):
+    """Liste des violations sur les commandes du test."""
+    domain = [('client_card', '=like', f'LOAD{run_id}-%')]
+    commandes = admin.call_kw('pos.caisse.commande', 'search_read', [domain],
+                              fields=['name', 'montant_livre', 'montant_cible'])
+    ids = [c['id'] for c in commandes]
+    groups = admin.call_kw('pos.livraison.livraison', 'read_group', [[('commande_id', 'in', ids)],
+                           ['montant_livre:sum'], ['commande_id']], lazy=False)
+    livre = {g['commande_id'][0]: g['montant_livre'] for g in groups}
+    violations = []
+    for c in commandes:
+        if c['montant_livre'] > c['montant_cible'] + 0.01:
+            violations.append(f"{c['name']}: livré {c['montant_livre']:.0f} > cible {c['montant_cible']:.0f}")
+        if abs(c['montant_livre'] - livre.get(c['id'], 0.0)) > 0.01:
+            violations.append(f"{c['name']}: montant_livre {c['montant_livre']:.0f} != somme des livraisons "
+                              f"{livre.get(c['id'], 0.0):.0f}")
+    return len(commandes), violations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:8069')
+    parser.add_argument('--db', required=True)
+    parser.add_argument('--admin-login', default='admin')
+    parser.add_argument('--admin-password', default='admin')
+    parser.add_argument('--drivers', type=int, default=50, help="nombre de livreurs simulés")
+    parser.add_argument('--orders', type=int, default=2000, help="commandes créées dans la file")
+    parser.add_argument('--max-sacs', type=int, default=5, help="sacs maximum par commande créée")
+    parser.add_argument('--duration', type=float, default=60.0, help="durée du test en secondes")
+    parser.add_argument('--think-time', type=float, default=0.2, help="pause moyenne entre deux actions (s)")
+    parser.add_argument('--stock-ratio', type=float, default=0.05, help="part des actions en sortie de stock")
+    parser.add_argument('--top-k', type=int, default=20, help="les livreurs choisissent parmi les K premières commandes")
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--tz', default='Africa/Kinshasa', help="fuseau des livreurs créés")
+    parser.add_argument('--seed', default='pos_livraison')
+    parser.add_argument('--close-sessions', action='store_true', help="fermer les sessions en fin de test")
+    parser.add_argument('--json', help="écrire le rapport JSON dans ce fichier")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    run_id = time.strftime('%Y%m%d%H%M%S')
+    admin = Client(args.url, args.db, timeout=max(args.timeout, 300))
+    admin.authenticate(args.admin_login, args.admin_password)
+    prix_sac = float(admin.call_kw('ir.config_parameter', 'get_param', ['pos_livraison.prix_sac', '222000']))
+    logins = setup_drivers(admin, args.drivers, args.tz)
+    setup_orders(admin, args.orders, run_id, prix_sac, args.max_sacs)
+    print(f"run {run_id}: {len(logins)} livreurs, {args.orders} commandes, {args.duration:.0f} s")
+
+    metrics = Metrics()
+    start = time.monotonic()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=run_driver, args=(args, login, deadline, metrics, prix_sac), daemon=True)
+               for login in logins]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    text, summary = metrics.report(time.monotonic() - start)
+    print(text)
+
+    checked, violations = check_invariants(admin, run_id)
+    summary.update(run_id=run_id, drivers=len(logins), orders=args.orders, violations=violations)
+    print(f"invariants: {checked} commandes vérifiées, {len(violations)} violation(s)")
+    for violation in violations[:50]:
+        print(f"  {violation}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
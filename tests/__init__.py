@@ -0,0 +1,13 @@
+from . import test_benchmark
+from . import test_query_count
+from . import test_session
+from . import test_stock_ledger
+from . import test_sortie_stock
+from . import test_jobs
+from . import test_replica
+from . import test_dispatch
+from . import test_forecast
+from . import test_dashboard
+from . import test_query_audit
+from . import test_sequence
+from . import test_state_events
@@ -0,0 +1,83 @@
+import json
+import time
+from contextlib import contextmanager
+
+from odoo.tests import common, new_test_user
+
+
+class LivraisonDataMixin:
+    """Jeu de données commun aux tests (commandes + livraisons partielles)."""
+
+    @classmethod
+    def _create_livreur(cls, login='livreur_test'):
+        return new_test_user(
+            cls.env, login=login, password=login, tz='Africa/Kinshasa',
+            groups='base.group_user,pos_livraison.group_pos_livraison_manager,pos_caisse.group_pos_caisse_user',
+        )
+
+    @classmethod
+    def _seed_commandes(cls, n_commandes, n_livraisons=0, user=None, montant=None):
+        """Crée `n_commandes` commandes avec `n_livraisons` livraisons chacune.
+        Les livraisons sont rattachées à la session ouverte de `user` (ou de l'utilisateur courant).
+        """
+        env = cls.env if user is None else cls.env(user=user)
+        prix_sac = float(env['ir.config_parameter'].sudo().get_param('pos_livraison.prix_sac', '222000'))
+        # Une commande doit pouvoir absorber toutes ses livraisons sans dépasser le montant cible
+        montant = montant or prix_sac * max(n_livraisons, 1)
+        commandes = env['pos.caisse.commande'].create([{
+            'client_name': f'Client {i}',
+            'client_card': f'CARD{i:05d}',
+            'total': montant,
+        } for i in range(n_commandes)])
+        if n_livraisons:
+            part = montant / n_livraisons
+            Liv = env['pos.livraison.livraison']
+            for c in commandes:
+                for _j in range(n_livraisons):
+                    Liv.create({'commande_id': c.id, 'montant_livre': part, 'type_paiement': 'cash'})
+        commandes.flush()
+        return commandes
+
+
+@contextmanager
+def measure(cr):
+    """Mesure la durée et le nombre de requêtes SQL exécutées dans le bloc."""
+    result = {}
+    start_queries = cr.sql_log_count
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+        result['queries'] = cr.sql_log_count - start_queries
+
+
+class LivraisonTransactionCase(LivraisonDataMixin, common.TransactionCase):
+    """Base des tests de modèles."""
+
+
+class LivraisonHttpCase(LivraisonDataMixin, common.HttpCase):
+    """Base des tests appelant l'API REST en JSON-RPC."""
+
+    @contextmanager
+    def _isolated(self):
+        """Annule les données créées dans le bloc (une taille de jeu de données à la fois)."""
+        self.env['base'].flush()
+        self.cr.execute('SAVEPOINT pos_livraison_isolated')
+        try:
+            yield
+        finally:
+            self.cr.execute('ROLLBACK TO SAVEPOINT pos_livraison_isolated')
+            self.env.clear()
+
+    def _json_call(self, route, params=None, method='POST'):
+        body = json.dumps({'jsonrpc': '2.0', 'method': 'call', 'params': params or {}})
+        response = self.opener.request(
+            method, self.base_url() + route, data=body,
+            headers={'Content-Type': 'application/json'}, timeout=60,
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get('error'):
+            raise AssertionError(f"{route}: {payload['error']}")
+        return payload.get('result')
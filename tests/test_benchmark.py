@@ -0,0 +1,143 @@
+"""Benchmarks des chemins critiques de livraison.
+
+Non exécutés par défaut: lancer avec `--test-tags benchmark`.
+Variables d'environnement:
+- POS_LIVRAISON_BENCH_SIZES: tailles "commandes x livraisons" (défaut: "10x2,100x4,500x4")
+- POS_LIVRAISON_BENCH_DIR: dossier de sortie des résultats JSON (défaut: dossier temporaire)
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import LivraisonHttpCase, measure
+
+_logger = logging.getLogger(__name__)
+
+
+def _bench_sizes():
+    raw = os.environ.get('POS_LIVRAISON_BENCH_SIZES', '10x2,100x4,500x4')
+    sizes = []
+    for chunk in raw.split(','):
+        n, _sep, m = chunk.strip().partition('x')
+        sizes.append((int(n), int(m or 1)))
+    return sizes
+
+
+@tagged('-standard', '-at_install', 'post_install', 'benchmark')
+class TestLivraisonBenchmark(LivraisonHttpCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_bench')
+        cls.results = []
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._dump_results()
+        super().tearDownClass()
+
+    @classmethod
+    def _dump_results(cls):
+        if not cls.results:
+            return
+        module = cls.env['ir.module.module'].sudo().search([('name', '=', 'pos_livraison')], limit=1)
+        version = module.latest_version or 'unknown'
+        payload = {
+            'module': 'pos_livraison',
+            'version': version,
+            'database': cls.env.cr.dbname,
+            'date': fields.Datetime.to_string(fields.Datetime.now()),
+            'results': cls.results,
+        }
+        directory = os.environ.get('POS_LIVRAISON_BENCH_DIR') or tempfile.gettempdir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"pos_livraison_bench_{version}_{int(time.time())}.json")
+        with open(path, 'w') as fp:
+            json.dump(payload, fp, indent=2)
+        _logger.info("Résultats benchmark pos_livraison écrits dans %s", path)
+
+    def _record(self, name, size, metrics, operations=1):
+        entry = {
+            'name': name,
+            'commandes': size[0],
+            'livraisons_par_commande': size[1],
+            'operations': operations,
+            'seconds': round(metrics['seconds'], 6),
+            'queries': metrics['queries'],
+            'ops_per_second': round(operations / metrics['seconds'], 2) if metrics['seconds'] else None,
+        }
+        self.results.append(entry)
+        _logger.info("bench %(name)s [%(commandes)sx%(livraisons_par_commande)s]: %(seconds).4fs, %(queries)s requêtes", entry)
+
+    def test_livraison_create_throughput(self):
+        for size in _bench_sizes():
+            n, m = size
+            with self._isolated():
+                commandes = self._seed_commandes(n, 0, user=self.livreur, montant=222000.0 * m)
+                Liv = self.env['pos.livraison.livraison'].with_user(self.livreur)
+                with measure(self.cr) as metrics:
+                    for c in commandes:
+                        for _j in range(m):
+                            Liv.create({'commande_id': c.id, 'montant_livre': 222000.0, 'type_paiement': 'cash'})
+                    Liv.flush()
+                self._record('livraison_create', size, metrics, operations=n * m)
+
+    def test_commande_aggregate_recompute(self):
+        Commande = self.env['pos.caisse.commande']
+        fnames = ['montant_livre', 'montant_restant', 'montant_livre_cash', 'montant_livre_bp',
+                  'sacs_farine_total', 'poids_farine_kg', 'progression']
+        for size in _bench_sizes():
+            with self._isolated():
+                commandes = self._seed_commandes(*size, user=self.livreur)
+                commandes.invalidate_cache()
+                for fname in fnames:
+                    self.env.add_to_compute(Commande._fields[fname], commandes)
+                with measure(self.cr) as metrics:
+                    commandes.recompute()
+                    commandes.flush()
+                self._record('commande_recompute', size, metrics, operations=len(commandes))
+
+    def test_ensure_open_for_user_latency(self):
+        Session = self.env['pos.livraison.session']
+        for size in _bench_sizes():
+            with self._isolated():
+                self._seed_commandes(*size, user=self.livreur)
+                with measure(self.cr) as metrics:
+                    Session._ensure_open_for_user(self.livreur.id)
+                self._record('ensure_open_session_ouverte', size, metrics)
+                Session.browse(Session._get_open_for_user(self.livreur.id)).action_close_session()
+                with measure(self.cr) as metrics:
+                    Session._ensure_open_for_user(self.livreur.id)
+                self._record('ensure_open_session_reouverture', size, metrics)
+
+    def test_sequence_allocation(self):
+        Sequence = self.env['ir.sequence']
+        for size in _bench_sizes():
+            count = size[0] * size[1]
+            with measure(self.cr) as metrics:
+                for _i in range(count):
+                    Sequence.next_by_code('pos.livraison.livraison')
+            self._record('sequence_par_reference', size, metrics, operations=count)
+            with measure(self.cr) as metrics:
+                Sequence._next_by_code_batch('pos.livraison.livraison', count)
+            self._record('sequence_par_lot', size, metrics, operations=count)
+
+    def test_api_routes(self):
+        self.authenticate(self.livreur.login, self.livreur.login)
+        for size in _bench_sizes():
+            with self._isolated():
+                self._seed_commandes(*size, user=self.livreur)
+                with measure(self.cr) as metrics:
+                    result = self._json_call('/api/livraison/commandes', {'limit': 0})
+                self.assertEqual(result['status'], 'success')
+                self._record('api_commandes', size, metrics)
+                with measure(self.cr) as metrics:
+                    result = self._json_call('/api/livraison/stats', method='GET')
+                self.assertEqual(result['status'], 'success')
+                self._record('api_stats', size, metrics)
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestDashboard(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_dashboard')
+        cls.Commande = cls.env['pos.caisse.commande']
+        # Seules les commandes du test sont affichées
+        cls.Commande.search([('etat_livraison', 'in', ('en_queue', 'en_cours', 'livree_partielle', 'livree'))]) \
+            .write({'etat_livraison': 'annulee'})
+
+    def _columns(self, limit):
+        return {c['etat']: c for c in self.Commande._dashboard_data(limit)}
+
+    def test_columns_counts_sums_and_top_cards(self):
+        commandes = self._seed_commandes(5, 0, user=self.livreur, montant=222000.0)
+        commandes[4].priority_livraison = '2'
+        commandes[3].write({'etat_livraison': 'livree', 'date_livraison_complete': fields.Datetime.now()})
+        commandes[2].write({'etat_livraison': 'livree',
+                            'date_livraison_complete': fields.Datetime.now() - timedelta(days=2)})
+        columns = self._columns(limit=2)
+        queue = columns['en_queue']
+        self.assertEqual(queue['count'], 3)
+        self.assertAlmostEqual(queue['montant_total'], 3 * 222000.0)
+        self.assertEqual([c['id'] for c in queue['cards']], [commandes[4].id, commandes[0].id])
+        self.assertTrue(queue['has_more'])
+        # Les livrées avant aujourd'hui ne sont pas chargées
+        self.assertEqual(columns['livree']['count'], 1)
+        self.assertEqual(columns['en_cours']['count'], 0)
+        self.assertEqual(columns['en_cours']['cards'], [])
+
+    def test_lazy_loading_continues_the_column(self):
+        commandes = self._seed_commandes(4, 0, user=self.livreur)
+        first = self._columns(limit=2)['en_queue']['cards']
+        rest = self.Commande._dashboard_cards('en_queue', offset=2, limit=10)
+        self.assertEqual([c['id'] for c in first + rest], commandes.ids)
@@ -0,0 +1,101 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import tagged
+
+from ..models.dispatch import get_heap
+from ..models.pos_livraison import DISPATCH_ASSIGN_TIMEOUT
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestDispatch(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_dispatch')
+        cls.autre = cls._create_livreur('livreur_dispatch_2')
+        cls.Commande = cls.env['pos.caisse.commande']
+        cls.Session = cls.env['pos.livraison.session']
+        # Seules les commandes du test sont à répartir
+        cls.Commande.search([('etat_livraison', '=', 'en_queue')]).write({'etat_livraison': 'annulee'})
+
+    def setUp(self):
+        super().setUp()
+        # Le tas survit aux rollbacks des tests précédents
+        get_heap(self.cr.dbname).reset()
+
+    def _commandes(self, priorities):
+        commandes = self._seed_commandes(len(priorities), 0, user=self.livreur)
+        for commande, priority in zip(commandes, priorities):
+            commande.priority_livraison = priority
+        commandes.flush()
+        return commandes
+
+    def test_next_follows_priority_then_age(self):
+        normale, urgente, tres_urgente = self._commandes(['0', '1', '2'])
+        first = self.Commande._dispatch_next(self.livreur.id)
+        self.assertEqual(first, tres_urgente)
+        self.assertEqual(first.livreur_assigne_id, self.livreur)
+        # Tant que la commande n'est pas livrée, elle reste la prochaine du livreur
+        self.assertEqual(self.Commande._dispatch_next(self.livreur.id), tres_urgente)
+        self.assertEqual(self.Commande._dispatch_next(self.autre.id), urgente)
+        tres_urgente.etat_livraison = 'livree'
+        self.assertEqual(self.Commande._dispatch_next(self.livreur.id), normale)
+        self.assertEqual(len(self.Commande._dispatch_heap()), 0)
+
+    def test_heap_sees_changes_since_sync(self):
+        normale, urgente = self._commandes(['0', '1'])
+        self.Commande._dispatch_heap()
+        normale.priority_livraison = '2'
+        urgente.etat_livraison = 'annulee'
+        normale.flush()
+        heap = self.Commande._dispatch_heap()
+        self.assertEqual(len(heap), 1)
+        self.assertEqual(self.Commande._dispatch_next(self.livreur.id), normale)
+
+    def test_claim_is_exclusive(self):
+        commande = self._commandes(['0'])
+        self.assertTrue(commande._dispatch_claim(self.livreur.id))
+        self.assertFalse(commande._dispatch_claim(self.autre.id))
+        self.assertEqual(commande.livreur_assigne_id, self.livreur)
+
+    def test_least_loaded_driver_served_first(self):
+        self.Session._ensure_open_for_user(self.autre.id)
+        # Session du premier livreur déjà chargée, commande livrée
+        self._seed_commandes(1, 2, user=self.livreur).etat_livraison = 'livree'
+        urgente = self._commandes(['2'])
+        assigned = self.Commande._dispatch_assign_open_sessions()
+        self.assertEqual(assigned, urgente)
+        self.assertEqual(urgente.livreur_assigne_id, self.autre)
+
+    def test_session_close_releases_assignment(self):
+        session = self.Session.browse(self.Session._ensure_open_for_user(self.livreur.id))
+        commande = self._commandes(['0'])
+        self.assertEqual(self.Commande._dispatch_next(self.livreur.id), commande)
+        session.action_close_session()
+        self.assertFalse(commande.livreur_assigne_id)
+        self.assertEqual(self.Commande._dispatch_next(self.autre.id), commande)
+
+    def test_stale_assignment_expires(self):
+        commande = self._commandes(['0'])
+        self.assertTrue(commande._dispatch_claim(self.livreur.id))
+        commande.date_assignation = fields.Datetime.now() - DISPATCH_ASSIGN_TIMEOUT - timedelta(minutes=1)
+        commande.flush()
+        self.assertEqual(self.Commande._dispatch_next(self.autre.id), commande)
+        self.assertEqual(commande.livreur_assigne_id, self.autre)
+
+    def test_failed_claim_keeps_heap_entry(self):
+        commande = self._commandes(['0'])
+        heap = self.Commande._dispatch_heap()
+        with patch.object(type(self.Commande), '_dispatch_claim', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.Commande._dispatch_next(self.livreur.id)
+        self.assertEqual(len(heap), 1)
+        self.assertEqual(self.Commande._dispatch_next(self.livreur.id), commande)
+        self.assertEqual(len(heap), 0)
+        # Annulation de la transaction: la commande redevient disponible dans ce processus
+        self.cr.postrollback.run()
+        self.assertEqual(len(heap), 1)
@@ -0,0 +1,63 @@
+import unittest
+from datetime import datetime, time, timedelta
+
+from odoo.tests import tagged
+
+from ..models.forecast import np
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestForecast(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_forecast')
+        cls.Stat = cls.env['pos.livraison.stat.daily']
+        cls.Forecast = cls.env['pos.livraison.forecast']
+
+    def _history(self, weeks, sacs_by_weekday):
+        """Une livraison par jour sur `weeks` semaines jusqu'à hier, `sacs_by_weekday[jour]` sacs."""
+        prix_sac = float(self.env['ir.config_parameter'].sudo().get_param('pos_livraison.prix_sac', '222000'))
+        today = self.Stat._local_today()
+        commande = self._seed_commandes(1, 0, user=self.livreur, montant=prix_sac * 10 * weeks * 7)
+        Liv = self.env['pos.livraison.livraison'].with_user(self.livreur)
+        for offset in range(1, weeks * 7 + 1):
+            day = today - timedelta(days=offset)
+            sacs = sacs_by_weekday[day.weekday()]
+            if sacs:
+                Liv.create({
+                    'commande_id': commande.id, 'montant_livre': prix_sac * sacs,
+                    'date': datetime.combine(day, time(12)), 'livreur_id': self.livreur.id,
+                })
+        return today
+
+    def _driver_rows(self, model):
+        return model.search([('dimension', '=', 'livreur'), ('livreur_id', '=', self.livreur.id)])
+
+    def test_daily_stats_are_incremental(self):
+        today = self._history(2, [1] * 7)
+        self.Stat._update_daily_stats()
+        rows = self._driver_rows(self.Stat)
+        self.assertEqual(len(rows), 14)
+        self.assertEqual(set(rows.mapped('sacs')), {1.0})
+        self.assertLess(max(rows.mapped('date')), today)
+        # Un second passage ne recalcule que le dernier jour agrégé
+        self.Stat._update_daily_stats()
+        self.assertEqual(len(self._driver_rows(self.Stat)), 14)
+
+    @unittest.skipIf(np is None, "numpy non installé")
+    def test_weekly_seasonality(self):
+        # Rien le dimanche, double le lundi
+        today = self._history(4, [2, 1, 1, 1, 1, 1, 0])
+        self.Forecast._cron_forecast()
+        forecasts = {f.date: f for f in self._driver_rows(self.Forecast)}
+        self.assertEqual(len(forecasts), self.Forecast.HORIZON)
+        for day, forecast in forecasts.items():
+            expected = [2, 1, 1, 1, 1, 1, 0][day.weekday()]
+            self.assertAlmostEqual(forecast.sacs, expected, places=3, msg=day)
+        self.assertEqual(min(forecasts), today)
+        total = self.Forecast.search([('dimension', '=', 'total'), ('date', '=', today)])
+        if total.nombre:
+            self.assertGreaterEqual(total.livreurs_requis, 1)
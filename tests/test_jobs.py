@@ -0,0 +1,42 @@
+from odoo.tests import tagged
+
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestLivraisonJobs(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_jobs')
+        cls.Job = cls.env['pos.livraison.job']
+
+    def test_side_effects_are_deferred(self):
+        commande = self._seed_commandes(1, 0, user=self.livreur, montant=444000.0)
+        self.env['pos.livraison.livraison'].with_user(self.livreur).create({
+            'commande_id': commande.id, 'montant_livre': 222000.0,
+        })
+        job = self.Job.search([('method_name', '=', '_job_after_create'), ('state', '=', 'pending')])
+        self.assertEqual(len(job), 1)
+        # L'état suit la livraison immédiatement, les notifications de seuil attendent le job
+        self.assertEqual(commande.etat_livraison, 'livree_partielle')
+        self.assertFalse(commande.last_progress_threshold)
+        self.Job._cron_process_jobs()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(commande.last_progress_threshold, 50)
+
+    def test_sync_context_runs_inline(self):
+        commande = self._seed_commandes(1, 0, user=self.livreur, montant=444000.0)
+        Liv = self.env['pos.livraison.livraison'].with_user(self.livreur).with_context(pos_livraison_jobs_sync=True)
+        Liv.create({'commande_id': commande.id, 'montant_livre': 444000.0})
+        self.assertFalse(self.Job.search([('method_name', '=', '_job_after_create'), ('state', '=', 'pending')]))
+        self.assertEqual(commande.etat_livraison, 'livree')
+
+    def test_failed_job_is_retried_then_marked_failed(self):
+        commande = self._seed_commandes(1, 0, user=self.livreur)
+        job = self.Job._enqueue(commande, '_job_notify_state', old_states='invalide')
+        for _i in range(self.Job.MAX_ATTEMPTS):
+            self.Job._cron_process_jobs()
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.attempts, self.Job.MAX_ATTEMPTS)
@@ -0,0 +1,151 @@
+"""Audit des plans d'exécution des requêtes de l'API.
+
+Non exécuté par défaut: lancer avec `--test-tags query_audit`.
+Chaque route est appelée sur un jeu de données volumineux (historique de commandes livrées,
+sessions closes); ses requêtes SELECT sont capturées puis rejouées avec EXPLAIN ANALYZE et les
+parcours séquentiels (Seq Scan) sont reportés.
+Variables d'environnement:
+- POS_LIVRAISON_AUDIT_SIZE: "commandes x livraisons" (défaut: "2000x2")
+- POS_LIVRAISON_AUDIT_DIR: dossier du rapport JSON (défaut: dossier temporaire)
+- POS_LIVRAISON_AUDIT_STRICT: si défini, échoue sur un Seq Scan d'une table du module
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+from odoo.tests import tagged
+
+from .common import LivraisonHttpCase
+
+_logger = logging.getLogger(__name__)
+
+MODULE_TABLES = ('pos_caisse_commande', 'pos_livraison_')
+ROUTES = [
+    ('/api/livraison/session/status', 'POST', None),
+    ('/api/livraison/commandes', 'POST', {'limit': 80}),
+    ('/api/livraison/livraisons', 'POST', {'limit': 80}),
+    ('/api/livraison/queue', 'GET', None),
+    ('/api/livraison/dispatch/next', 'POST', None),
+    ('/api/livraison/dashboard', 'POST', {'limit': 10}),
+    ('/api/livraison/dashboard/cards', 'POST', {'etat': 'en_queue', 'offset': 10, 'limit': 20}),
+    ('/api/livraison/stats', 'GET', None),
+    ('/api/livraison/stock', 'POST', None),
+    ('/api/livraison/forecast', 'POST', None),
+]
+
+
+def _seq_scans(plan):
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            yield node
+        nodes.extend(node.get('Plans', []))
+
+
+@tagged('-standard', '-at_install', 'post_install', 'query_audit')
+class TestQueryPlanAudit(LivraisonHttpCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_audit')
+
+    def _seed_history(self):
+        raw = os.environ.get('POS_LIVRAISON_AUDIT_SIZE', '2000x2')
+        n, _sep, m = raw.partition('x')
+        commandes = self._seed_commandes(int(n), int(m or 1), user=self.livreur)
+        # Historique réaliste: l'essentiel des commandes est livré depuis longtemps
+        active = commandes[-max(20, len(commandes) // 20):]
+        self.cr.execute("""
+            UPDATE pos_caisse_commande
+               SET etat_livraison = 'livree', date_livraison_complete = create_date - interval '30 days'
+             WHERE id IN %s
+        """, (tuple((commandes - active).ids),))
+        self.cr.execute("UPDATE pos_caisse_commande SET etat_livraison = 'en_queue' WHERE id IN %s",
+                        (tuple(active.ids),))
+        self.env['pos.livraison.session'].create([{
+            'user_id': self.livreur.id, 'state': 'ferme', 'date': '2020-01-01 12:00:00',
+        } for _i in range(200)])
+        self.env['base'].flush()
+        self.env.cache.invalidate()
+        for table in ('pos_caisse_commande', 'pos_livraison_livraison', 'pos_livraison_session',
+                      'pos_livraison_sortie_stock', 'pos_livraison_stock_move', 'pos_livraison_forecast'):
+            self.cr.execute(f"ANALYZE {table}")
+
+    @contextmanager
+    def _capture(self):
+        """Requêtes exécutées par le curseur de test (y compris depuis les requêtes HTTP)."""
+        queries = []
+        execute = self.cr.execute
+
+        def capture(query, params=None, *args, **kwargs):
+            queries.append((query, params))
+            return execute(query, params, *args, **kwargs)
+
+        self.cr.execute = capture
+        try:
+            yield queries
+        finally:
+            del self.cr.execute
+
+    def _explain(self, query, params):
+        if not isinstance(query, str):
+            query = query.as_string(self.cr._obj)
+        if not query.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return None
+        try:
+            with self.cr.savepoint():
+                self.cr.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}", params)
+                return query, self.cr.fetchone()[0][0]
+        except psycopg2.Error:
+            _logger.info("EXPLAIN impossible pour %s", query, exc_info=True)
+            return None
+
+    def test_audit_routes(self):
+        self.authenticate(self.livreur.login, self.livreur.login)
+        report = []
+        with self._isolated():
+            self._seed_history()
+            for route, method, params in ROUTES:
+                # Premier appel à blanc: caches ORM
+                self._json_call(route, params, method=method)
+                with self._capture() as queries:
+                    result = self._json_call(route, params, method=method)
+                self.assertEqual(result.get('status'), 'success', f"{route}: {result}")
+                seen = set()
+                for query, query_params in queries:
+                    explained = self._explain(query, query_params)
+                    if not explained or explained[0] in seen:
+                        continue
+                    seen.add(explained[0])
+                    text, plan = explained
+                    for node in _seq_scans(plan['Plan']):
+                        report.append({
+                            'route': route,
+                            'table': node.get('Relation Name'),
+                            'module_table': (node.get('Relation Name') or '').startswith(MODULE_TABLES),
+                            'rows': node.get('Actual Rows'),
+                            'rows_removed': node.get('Rows Removed by Filter', 0),
+                            'ms': plan.get('Execution Time'),
+                            'query': ' '.join(text.split()),
+                        })
+        self._dump(report)
+        flagged = [r for r in report if r['module_table']]
+        for row in flagged:
+            _logger.warning("Seq Scan %(table)s sur %(route)s (%(rows)s lignes, %(rows_removed)s filtrées): %(query)s", row)
+        if os.environ.get('POS_LIVRAISON_AUDIT_STRICT'):
+            self.assertFalse(flagged, f"{len(flagged)} Seq Scan sur les tables du module")
+
+    def _dump(self, report):
+        directory = os.environ.get('POS_LIVRAISON_AUDIT_DIR') or tempfile.gettempdir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"pos_livraison_query_audit_{int(time.time())}.json")
+        with open(path, 'w') as fp:
+            json.dump({'database': self.env.cr.dbname, 'seq_scans': report}, fp, indent=2)
+        _logger.info("Audit des plans pos_livraison: %s Seq Scan, rapport dans %s", len(report), path)
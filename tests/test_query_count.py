@@ -0,0 +1,147 @@
+import inspect
+
+from odoo.tests import tagged
+
+from ..controllers.main import PosLivraisonController
+from .common import LivraisonHttpCase, measure
+
+# Deux volumes (commandes x livraisons par commande): le nombre de requêtes doit être identique.
+SMALL = (3, 2)
+LARGE = (15, 4)
+# Routes à budget rejouées par les tests ci-dessous
+COVERED = {
+    'session_status', 'session_open', 'session_close', 'get_commandes', 'list_livraisons',
+    'get_commande_detail', 'get_queue', 'dispatch_next', 'get_dashboard', 'get_dashboard_cards',
+    'get_stats', 'create_livraison', 'create_sortie_stock', 'create_sortie_stock_batch',
+    'get_forecast', 'get_stock',
+}
+
+
+@tagged('-at_install', 'post_install')
+class TestRouteQueryCount(LivraisonHttpCase):
+    """Rejoue chaque route de l'API sur deux volumes de données et vérifie que le
+    nombre de requêtes SQL est constant et respecte le budget déclaré sur la route."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_queries')
+
+    def _route_queries(self, size, route, method='POST', params=None, prepare=None):
+        """Nombre de requêtes de `route` après seed de `size`; `params` peut être
+        un callable recevant les commandes créées. `prepare` est appelé avant chacun des
+        deux appels (routes qui changent l'état qu'elles lisent)."""
+        with self._isolated():
+            commandes = self._seed_commandes(*size, user=self.livreur)
+            # Commande vierge pour les routes d'écriture
+            self._seed_commandes(1, 0, user=self.livreur)
+            call_params = params(commandes) if callable(params) else params
+            if prepare:
+                prepare()
+            # Premier appel à blanc: caches ORM (groupes, règles d'accès, paramètres)
+            self._json_call(route, call_params, method=method)
+            if prepare:
+                prepare()
+            with measure(self.cr) as metrics:
+                result = self._json_call(route, call_params, method=method)
+            self.assertEqual(result.get('status'), 'success', f"{route}: {result}")
+        return metrics['queries']
+
+    def _assert_constant(self, handler, route, method='POST', params=None, prepare=None):
+        budget = getattr(getattr(PosLivraisonController, handler), '_query_budget', None)
+        self.assertTrue(budget, f"{handler}: aucun @query_budget déclaré")
+        small = self._route_queries(SMALL, route, method, params, prepare)
+        large = self._route_queries(LARGE, route, method, params, prepare)
+        self.assertEqual(small, large, f"{route}: {small} requêtes pour {SMALL}, {large} pour {LARGE}")
+        self.assertLessEqual(large, budget, f"{route}: {large} requêtes, budget {budget}")
+
+    def setUp(self):
+        super().setUp()
+        self.authenticate(self.livreur.login, self.livreur.login)
+
+    def test_session_status(self):
+        self._assert_constant('session_status', '/api/livraison/session/status')
+
+    def test_session_open(self):
+        self._assert_constant('session_open', '/api/livraison/session/open')
+
+    def test_session_close(self):
+        Session = self.env['pos.livraison.session']
+
+        def reopen():
+            # La session fermée par l'appel à blanc est rouverte avant la mesure
+            if not Session._get_open_for_user(self.livreur.id):
+                Session.search([('user_id', '=', self.livreur.id)], order='id desc', limit=1).action_open_session()
+            Session.flush()
+        self._assert_constant('session_close', '/api/livraison/session/close', prepare=reopen)
+
+    def test_commandes(self):
+        self._assert_constant('get_commandes', '/api/livraison/commandes', params={'limit': 0})
+
+    def test_livraisons_current_session(self):
+        self._assert_constant('list_livraisons', '/api/livraison/livraisons', params={'limit': 0})
+
+    def test_livraisons_all_sessions(self):
+        self._assert_constant('list_livraisons', '/api/livraison/livraisons',
+                              params={'session_mode': 'none', 'limit': 0})
+
+    def test_commande_detail(self):
+        # Le détail porte toujours sur la commande la plus chargée du jeu de données
+        budget = PosLivraisonController.get_commande_detail._query_budget
+        counts = []
+        for size in (SMALL, LARGE):
+            with self._isolated():
+                commande = self._seed_commandes(size[0], size[1], user=self.livreur)[-1]
+                route = f'/api/livraison/commande/{commande.id}'
+                self._json_call(route, method='GET')
+                with measure(self.cr) as metrics:
+                    result = self._json_call(route, method='GET')
+                self.assertEqual(result.get('status'), 'success')
+                self.assertEqual(len(result['data']['livraisons']), size[1])
+                counts.append(metrics['queries'])
+        self.assertEqual(counts[0], counts[1], f"détail commande: {counts}")
+        self.assertLessEqual(counts[1], budget)
+
+    def test_queue(self):
+        self._assert_constant('get_queue', '/api/livraison/queue', method='GET')
+
+    def test_dispatch_next(self):
+        self._assert_constant('dispatch_next', '/api/livraison/dispatch/next')
+
+    def test_dashboard(self):
+        self._assert_constant('get_dashboard', '/api/livraison/dashboard', params={'limit': 10})
+
+    def test_dashboard_cards(self):
+        self._assert_constant('get_dashboard_cards', '/api/livraison/dashboard/cards',
+                              params={'etat': 'livree_partielle', 'limit': 50})
+
+    def test_stats(self):
+        self._assert_constant('get_stats', '/api/livraison/stats', method='GET')
+
+    def test_nouvelle_livraison(self):
+        def params(commandes):
+            vierge = self.env['pos.caisse.commande'].search(
+                [('livraison_ids', '=', False)], order='id desc', limit=1)
+            return {'commande_id': vierge.id, 'montant_livre': 1000.0}
+        self._assert_constant('create_livraison', '/api/livraison/nouvelle_livraison', params=params)
+
+    def test_sortie_stock(self):
+        self._assert_constant('create_sortie_stock', '/api/livraison/sortie_stock',
+                              params={'motif': 'Contrôle', 'quantite_sacs': 1})
+
+    def test_sortie_stock_batch(self):
+        self._assert_constant('create_sortie_stock_batch', '/api/livraison/sortie_stock/batch', params={'sorties': [
+            {'motif': 'Perte', 'quantite_sacs': 1, 'type': 'perte'},
+            {'motif': 'Don', 'quantite_sacs': 2, 'type': 'don'},
+        ]})
+
+    def test_forecast(self):
+        self._assert_constant('get_forecast', '/api/livraison/forecast', params={'dimension': 'livreur'})
+
+    def test_stock(self):
+        self._assert_constant('get_stock', '/api/livraison/stock')
+
+    def test_every_budget_is_checked(self):
+        budgeted = {name for name, func in inspect.getmembers(PosLivraisonController, inspect.isfunction)
+                    if getattr(func, '_query_budget', None)}
+        self.assertFalse(budgeted - COVERED, "routes à budget sans test de nombre de requêtes")
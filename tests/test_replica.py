@@ -0,0 +1,43 @@
+from odoo.tests import tagged
+
+from ..controllers.replica import read_on_replica
+from .common import LivraisonTransactionCase
+
+
+def _count_livraisons(env):
+    return env['pos.livraison.livraison'].sudo().search_count([])
+
+
+@tagged('-at_install', 'post_install')
+class TestReplicaRouting(LivraisonTransactionCase):
+    """La « réplique » est simulée par une seconde connexion à la base de test: elle ne voit
+    pas les données non validées de la transaction de test, ce qui permet de savoir où la
+    lecture a eu lieu."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_replica')
+        cls.params = cls.env['ir.config_parameter'].sudo()
+
+    def setUp(self):
+        super().setUp()
+        self.before = _count_livraisons(self.env)
+        self._seed_commandes(2, 1, user=self.livreur)
+        self.env['base'].flush()
+
+    def test_without_replica_reads_primary(self):
+        self.assertEqual(read_on_replica(self.env, _count_livraisons), self.before + 2)
+
+    def test_reads_replica(self):
+        self.params.set_param('pos_livraison.replica_db', self.env.cr.dbname)
+        self.assertEqual(read_on_replica(self.env, _count_livraisons), self.before)
+
+    def test_stale_replica_falls_back(self):
+        self.params.set_param('pos_livraison.replica_db', self.env.cr.dbname)
+        self.params.set_param('pos_livraison.replica_max_lag', '-1')
+        self.assertEqual(read_on_replica(self.env, _count_livraisons), self.before + 2)
+
+    def test_unreachable_replica_falls_back(self):
+        self.params.set_param('pos_livraison.replica_db', 'pos_livraison_replica_inexistante')
+        self.assertEqual(read_on_replica(self.env, _count_livraisons), self.before + 2)
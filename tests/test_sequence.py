@@ -0,0 +1,35 @@
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('-at_install', 'post_install')
+class TestSequenceBatch(TransactionCase):
+
+    def _sequence(self, **vals):
+        return self.env['ir.sequence'].create(dict({
+            'name': 'Test lot', 'code': 'pos.livraison.test', 'prefix': 'T-', 'padding': 4,
+        }, **vals))
+
+    def test_data_sequences_are_native(self):
+        for xmlid in ('pos_livraison.seq_pos_livraison_livraison', 'pos_livraison.seq_pos_livraison_sortie'):
+            self.assertEqual(self.env.ref(xmlid).implementation, 'standard')
+
+    def test_standard(self):
+        self._sequence(implementation='standard')
+        Sequence = self.env['ir.sequence']
+        self.assertEqual(Sequence._next_by_code_batch('pos.livraison.test', 3), ['T-0001', 'T-0002', 'T-0003'])
+        self.assertEqual(Sequence.next_by_code('pos.livraison.test'), 'T-0004')
+
+    def test_no_gap(self):
+        self._sequence(implementation='no_gap', number_increment=2)
+        Sequence = self.env['ir.sequence']
+        self.assertEqual(Sequence._next_by_code_batch('pos.livraison.test', 3), ['T-0001', 'T-0003', 'T-0005'])
+        self.assertEqual(Sequence.next_by_code('pos.livraison.test'), 'T-0007')
+
+    def test_date_range(self):
+        self._sequence(implementation='standard', use_date_range=True, prefix='T-%(range_year)s-')
+        Sequence = self.env['ir.sequence'].with_context(ir_sequence_date='2024-03-01')
+        self.assertEqual(Sequence._next_by_code_batch('pos.livraison.test', 2), ['T-2024-0001', 'T-2024-0002'])
+        self.assertEqual(Sequence.next_by_code('pos.livraison.test'), 'T-2024-0003')
+        # Autre exercice: nouvelle plage, numérotation repartie de 1
+        Sequence = Sequence.with_context(ir_sequence_date='2025-01-10')
+        self.assertEqual(Sequence._next_by_code_batch('pos.livraison.test', 1), ['T-2025-0001'])
@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestSessionSummary(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_session')
+        cls.Session = cls.env['pos.livraison.session']
+
+    def test_close_builds_summary(self):
+        commandes = self._seed_commandes(3, 2, user=self.livreur)
+        session = self.Session.browse(self.Session._get_open_for_user(self.livreur.id))
+        self.env['pos.livraison.sortie.stock'].create({
+            'motif': 'Contrôle', 'quantite_sacs': 2, 'type': 'perte', 'session_id': session.id,
+        })
+        session.action_close_session()
+        summary = session.summary_id
+        self.assertTrue(summary)
+        self.assertEqual(summary.nombre_livraisons, 6)
+        self.assertEqual(summary.nombre_commandes, 3)
+        self.assertAlmostEqual(summary.montant_total, sum(commandes.mapped('montant_livre')))
+        lines = {(l.dimension, l.cle): l for l in summary.line_ids}
+        self.assertEqual(lines[('type_paiement', 'cash')].nombre, 6)
+        self.assertEqual(lines[('sortie_stock', 'non')].nombre, 6)
+        self.assertEqual(lines[('type_sortie', 'perte')].sacs, 2)
+
+    def test_reopen_drops_summary(self):
+        self._seed_commandes(1, 1, user=self.livreur)
+        session = self.Session.browse(self.Session._get_open_for_user(self.livreur.id))
+        session.action_close_session()
+        self.assertTrue(session.summary_id)
+        session.action_open_session()
+        self.assertFalse(session.summary_id)
+
+    def test_cron_rollover(self):
+        self._seed_commandes(1, 1, user=self.livreur)
+        old = self.Session.browse(self.Session._get_open_for_user(self.livreur.id))
+        old.date = fields.Datetime.now() - timedelta(days=2)
+        self.Session._cron_rollover_sessions()
+        self.assertEqual(old.state, 'ferme')
+        self.assertTrue(old.summary_id)
+        new_sid = self.Session._get_open_for_user(self.livreur.id)
+        self.assertTrue(new_sid)
+        self.assertNotEqual(new_sid, old.id)
@@ -0,0 +1,50 @@
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestSortieStockBatch(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_sortie')
+        cls.Sortie = cls.env['pos.livraison.sortie.stock'].with_user(cls.livreur)
+
+    def test_batch_creates_linked_pairs(self):
+        sorties = self.Sortie._create_with_livraisons([
+            {'motif': 'Perte', 'quantite_sacs': 2, 'type': 'perte'},
+            {'motif': 'Don', 'montant': 444000, 'type': 'don'},
+        ])
+        self.assertEqual(len(sorties), 2)
+        self.assertEqual(len(set(sorties.mapped('name'))), 2)
+        self.assertEqual(len(sorties.mapped('session_id')), 1)
+        livraisons = sorties.mapped('livraison_ids')
+        self.assertEqual(len(livraisons), 2)
+        self.assertTrue(all(livraisons.mapped('is_sortie_stock')))
+        self.assertEqual(livraisons.sorted('id').mapped('motif'), ['Perte', 'Don'])
+        self.assertAlmostEqual(sorties[1].quantite_sacs, 2.0)
+
+    def test_edit_syncs_linked_livraisons(self):
+        sortie = self.Sortie._create_with_livraisons([{'motif': 'Perte', 'quantite_sacs': 1, 'type': 'perte'}])
+        sortie.sudo().write({'motif': 'Don', 'type': 'don'})
+        self.assertEqual(sortie.livraison_ids.motif, 'Don')
+        self.assertEqual(sortie.livraison_ids.type_sortie, 'don')
+
+    def test_batch_is_atomic(self):
+        before = self.Sortie.search_count([])
+        with self.assertRaisesRegex(UserError, 'Sortie 2: motif requis'):
+            self.Sortie._create_with_livraisons([
+                {'motif': 'Perte', 'quantite_sacs': 1},
+                {'quantite_sacs': 1},
+            ])
+        self.assertEqual(self.Sortie.search_count([]), before)
+
+    def test_sequence_batch_is_consecutive(self):
+        names = self.env['ir.sequence']._next_by_code_batch('pos.livraison.sortie', 3)
+        numbers = [int(name.split('-')[-1]) for name in names]
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 3)))
+        following = self.env['ir.sequence'].next_by_code('pos.livraison.sortie')
+        self.assertEqual(int(following.split('-')[-1]), numbers[-1] + 1)
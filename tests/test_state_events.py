@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestStateEvents(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_events')
+        cls.Event = cls.env['pos.livraison.state.event']
+        cls.Dwell = cls.env['pos.livraison.state.dwell']
+
+    def _events(self, commande):
+        return self.Event.search([('commande_id', '=', commande.id)], order='date, id')
+
+    def test_transitions_are_logged(self):
+        commande = self._seed_commandes(1, 0, user=self.livreur)
+        commande.etat_livraison = 'en_cours'
+        commande.priority_livraison = '1'
+        commande.etat_livraison = 'livree'
+        events = self._events(commande)
+        self.assertEqual([(e.etat_avant or False, e.etat_apres) for e in events],
+                         [(False, 'en_queue'), ('en_queue', 'en_cours'), ('en_cours', 'livree')])
+        self.assertEqual(events[-1].user_id, self.env.user)
+
+    def test_log_is_append_only(self):
+        event = self._events(self._seed_commandes(1, 0, user=self.livreur))
+        with self.assertRaises(UserError):
+            event.write({'etat_apres': 'livree'})
+        with self.assertRaises(UserError):
+            event.unlink()
+
+    def test_dwell_aggregates(self):
+        commandes = self._seed_commandes(2, 0, user=self.livreur)
+        start = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) - timedelta(days=3)
+        rows = []
+        for commande, attente in zip(commandes, (2, 4)):
+            rows += [
+                (commande.id, None, 'en_queue', start),
+                (commande.id, 'en_queue', 'en_cours', start + timedelta(hours=attente)),
+                (commande.id, 'en_cours', 'livree', start + timedelta(hours=attente + 1)),
+            ]
+        # Historique antérieur à aujourd'hui (les événements de création du test sont datés de maintenant)
+        self.cr.execute("DELETE FROM pos_livraison_state_event WHERE commande_id IN %s", (tuple(commandes.ids),))
+        self.cr.execute(
+            "INSERT INTO pos_livraison_state_event (commande_id, etat_avant, etat_apres, date) VALUES "
+            + ', '.join(['%s'] * len(rows)), rows)
+        today = self.env['pos.livraison.stat.daily']._local_today()
+        self.Dwell._update_dwell(date_from=today - timedelta(days=10))
+        queue = self.Dwell.search([('etat', '=', 'en_queue')])
+        self.assertEqual(sum(queue.mapped('nombre')), 2)
+        self.assertAlmostEqual(sum(queue.mapped('duree_totale')), 6.0, places=4)
+        self.assertAlmostEqual(max(queue.mapped('duree_max')), 4.0, places=4)
+        en_cours = self.Dwell.search([('etat', '=', 'en_cours')])
+        self.assertAlmostEqual(sum(en_cours.mapped('duree_totale')) / sum(en_cours.mapped('nombre')), 1.0, places=4)
@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+
+from .common import LivraisonTransactionCase
+
+
+@tagged('-at_install', 'post_install')
+class TestStockLedger(LivraisonTransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.livreur = cls._create_livreur('livreur_stock')
+        cls.Move = cls.env['pos.livraison.stock.move']
+        cls.Checkpoint = cls.env['pos.livraison.stock.checkpoint']
+
+    def test_balance_with_checkpoint(self):
+        start = fields.Datetime.now() - timedelta(seconds=1)
+        self.Move.create({'type': 'reception', 'quantite_sacs': 10, 'date': start})
+        self._seed_commandes(1, 1, user=self.livreur)  # 1 sac livré
+        self.env['pos.livraison.sortie.stock'].create({'motif': 'Perte', 'quantite_sacs': 2, 'type': 'perte'})
+        solde, checkpoint = self.Move._get_balance()
+        self.assertAlmostEqual(solde, 7.0)
+        self.assertFalse(checkpoint)
+
+        checkpoint = self.Checkpoint._create_checkpoint()
+        self.assertAlmostEqual(checkpoint.solde_sacs, 7.0)
+        later = fields.Datetime.now() + timedelta(hours=1)
+        self.Move.create({'type': 'reception', 'quantite_sacs': 5, 'date': later})
+        solde, used = self.Move._get_balance(later)
+        self.assertAlmostEqual(solde, 12.0)
+        self.assertEqual(used, checkpoint)
+        # Solde à une date antérieure à tous les mouvements
+        self.assertAlmostEqual(self.Move._get_balance(start - timedelta(days=1))[0], 0.0)
+
+    def test_corrections_are_appended(self):
+        sortie = self.env['pos.livraison.sortie.stock'].create({'motif': 'Don', 'quantite_sacs': 3, 'type': 'don'})
+        sortie.quantite_sacs = 1
+        moves = self.Move.search([('name', '=', sortie.name)])
+        self.assertEqual(sorted(moves.mapped('quantite_sacs')), [-3.0, 2.0])
+        with self.assertRaises(UserError):
+            moves.write({'quantite_sacs': 0})
+        with self.assertRaises(UserError):
+            moves.unlink()
+
+    def test_backdated_move_drops_later_checkpoints(self):
+        checkpoint = self.Checkpoint._create_checkpoint()
+        self.Move.create({'type': 'reception', 'quantite_sacs': 4,
+                          'date': fields.Datetime.now() - timedelta(days=1)})
+        self.assertFalse(checkpoint.exists())
+
+    def test_create_empty_keeps_checkpoints(self):
+        checkpoint = self.Checkpoint._create_checkpoint()
+        self.assertFalse(self.Move.create([]))
+        self.assertTrue(checkpoint.exists())
+
+    def test_move_backdated_in_checkpoint_window(self):
+        self.Move.create({'type': 'reception', 'quantite_sacs': 10,
+                          'date': fields.Datetime.now() - timedelta(minutes=10)})
+        at = fields.Datetime.now()
+        checkpoint = self.Checkpoint._create_checkpoint(at)
+        # Mouvement validé juste après, daté avant la clôture
+        self.Move.create({'type': 'reception', 'quantite_sacs': 5, 'date': at - timedelta(seconds=1)})
+        self.assertFalse(checkpoint.exists())
+        solde, _checkpoint = self.Move._get_balance(at)
+        self.assertAlmostEqual(solde, 15.0 + self.Move._get_balance(at - timedelta(minutes=11))[0])
+
+    def test_ledger_writes_are_serialized(self):
+        # Mouvements et points de contrôle mettent à jour la même ligne avant de lire
+        self.cr.execute("SELECT version FROM pos_livraison_stock_ledger_head WHERE id = 1")
+        version = self.cr.fetchone()[0]
+        self.Checkpoint._create_checkpoint()
+        self.Move.create({'type': 'reception', 'quantite_sacs': 1})
+        self.cr.execute("SELECT version FROM pos_livraison_stock_ledger_head WHERE id = 1")
+        self.assertEqual(self.cr.fetchone()[0], version + 2)